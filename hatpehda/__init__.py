@@ -1,3 +1,10 @@
 from .hatpehda import multi_decomposition, State, declare_triggers, declare_methods, declare_operators, set_state,\
     add_tasks, seek_plan_robot, select_conditional_plan, agents, get_last_actions, get_first_action, reset_planner,\
-    set_idle_cost_function, set_wait_cost_function, set_undesired_state_functions, set_undesired_sequence_functions
+    set_idle_cost_function, set_wait_cost_function, set_undesired_state_functions, set_undesired_sequence_functions,\
+    iter_plan_robot, SearchEngine, DepthFirstFrontier, BreadthFirstFrontier, BestFirstFrontier, seek_policy_robot,\
+    PolicySearch, SearchBudget, SearchResult, InPlaceSearch, unsafe_in_place, operator, OperatorSchema, trigger_reads,\
+    tracked_trigger, set_human_prediction_cache, HumanPredictionCache, HumanPredictionType,\
+    likelihood, WeightedSubtasks, HumanBeam, declare_symmetries, detect_symmetries,\
+    evaluate_policy, PolicySelection, default_action_cost, PolicyGraph,\
+    PolicyCriterion, PolicyValues
+from .facts import FactIndex, FactSet
@@ -2,7 +2,8 @@
 
 from copy import deepcopy
 import hatpehda
-from hatpehda.hatpehda import Operator
+from hatpehda.hatpehda import Operator, OperatorSchema
+from hatpehda.facts import holds
 from hatpehda.hatpehda import get_last_actions
 from hatpehda.hatpehda import _backtrack_plan_one_branch
 
@@ -49,6 +50,8 @@ def get_state_attributes(state):
     for att in all_attributes:
         if att[0] == '_' and att[1] == '_' and att[-2] == '_' and att[-1] == '_': # test separatly to handle attribute name with only one caracter
             attributes.remove(att)
+        elif callable(getattr(type(state), att, None)): # methods of the state
+            attributes.remove(att)
     return attributes
 
 def set_link(links, step, target, type):
@@ -88,14 +91,20 @@ def get_app_steps(agents, other_steps):
 
     # For each step in other_steps, try to apply the operator of the step
     for other_step in other_steps:
-        newagents = deepcopy(agents)
         if other_step.action.name == "BEGIN":
             continue
         elif other_step.action.name == "IDLE":
             applicable_steps.append(other_step)
         else:
-            operator = newagents[other_step.action.agent].operators[other_step.action.name]
-            result = operator(newagents, newagents[other_step.action.agent].state, other_step.action.agent, *other_step.action.parameters)
+            agent_name = other_step.action.agent
+            operator = agents[agent_name].operators[other_step.action.name]
+            if isinstance(operator, OperatorSchema):
+                # Declarative operators are tested without copying the states
+                if operator.applicable(agents[agent_name].state, agent_name, other_step.action.parameters):
+                    applicable_steps.append(other_step)
+                continue
+            newagents = deepcopy(agents)
+            result = operator(newagents, newagents[agent_name].state, agent_name, *other_step.action.parameters)
             if result != False:
                 applicable_steps.append(other_step)
 
@@ -173,6 +182,35 @@ def apply_effect(agents, step):
 
     return newagents
 
+def compute_declared_effects(previous_agents, step):
+    """
+    Computes and returns the effects of a step whose operator is declarative (see hatpehda.operator) from its
+    add and delete facts, without applying it. Returns None if the operator is not declarative or if it changes
+    a property which is not a dict, the effects being then computed by compute_effects.
+    """
+    operator = previous_agents[step.action.agent].operators[step.action.name]
+    if not isinstance(operator, OperatorSchema):
+        return None
+    add, delete = operator.effects(step.action.agent, step.action.parameters)
+    if any(subject is None for _, subject, _ in add + delete):
+        return None
+    previous_state = previous_agents["robot"].state
+    modifs = {"remove": [], "append": []}
+    deleted = set()
+    for attribute, key, val in delete:
+        if holds(previous_state, (attribute, key, val)):
+            deleted.add((attribute, key, val))
+            modifs["remove"].append(Modif(attribute, key, val))
+    for attribute, key, val in add:
+        if not holds(previous_state, (attribute, key, val)):
+            previous_val = previous_state.peek(attribute).get(key)
+            # A value which is not a list is replaced, unless it is already deleted
+            if previous_val is not None and not isinstance(previous_val, list) and \
+                    (attribute, key, previous_val) not in deleted:
+                modifs["remove"].append(Modif(attribute, key, previous_val))
+            modifs["append"].append(Modif(attribute, key, val))
+    return modifs
+
 def compute_effects(previous_agents, current_agents):
     """
     Computes and returns the effects of a step by checking the differences
@@ -279,7 +317,9 @@ def initialize(initial_agents, plan):
         step.agents = step_agents
 
         # Computes and adds the effects of the action
-        effects = compute_effects(previous_agents, step_agents)
+        effects = compute_declared_effects(previous_agents, step)
+        if effects is None:
+            effects = compute_effects(previous_agents, step_agents)
         step.effects = effects
 
         steps.append(step)
@@ -0,0 +1,204 @@
+"""
+Persistent containers for the agendas and the plans of the agents.
+
+Every node of the search copies the agents, so these containers store their items in immutable linked cells
+(item, rest) shared between the copies: copying a container, removing the first tasks of an agenda, adding tasks in
+front of it and adding an action to a plan do not copy the rest of the items.
+Both containers behave like the lists they replace for the domain code (indexing, slicing, iteration, len, +, ==).
+"""
+
+from collections.abc import MutableSequence, Sequence
+
+
+def _cells_from(items, rest=None):
+    """Cells of the items in front of the rest cells."""
+    for item in reversed(items):
+        rest = (item, rest)
+    return rest
+
+
+def _iter_cells(cells):
+    while cells is not None:
+        yield cells[0]
+        cells = cells[1]
+
+
+def _drop(cells, n):
+    for _ in range(n):
+        cells = cells[1]
+    return cells
+
+
+class Agenda(MutableSequence):
+    """
+    Tasks of an agent, first task first. Getting the tasks after the first ones (agenda[n:]) and adding a list in
+    front (tasks + agenda) only cost the number of removed or added tasks, the other tasks being shared.
+    Changing a task at an index costs the index, and appending a task costs the length of the agenda.
+    """
+    __slots__ = ("_cells", "_len")
+
+    def __init__(self, tasks=()):
+        tasks = list(tasks)
+        self._cells = _cells_from(tasks)
+        self._len = len(tasks)
+
+    @classmethod
+    def _make(cls, cells, length):
+        new = cls.__new__(cls)
+        new._cells = cells
+        new._len = length
+        return new
+
+    def copy(self):
+        return Agenda._make(self._cells, self._len)
+
+    def _index(self, index):
+        if index < 0:
+            index += self._len
+        if index < 0 or index >= self._len:
+            raise IndexError("agenda index out of range")
+        return index
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return _iter_cells(self._cells)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step == 1 and stop == self._len:
+                return Agenda._make(_drop(self._cells, start), self._len - start)
+            return Agenda(list(self)[index])
+        return _drop(self._cells, self._index(index))[0]
+
+    def _replace(self, index, items, removed):
+        """Replaces the removed tasks from index by items, copying the cells before index only."""
+        prefix = []
+        cells = self._cells
+        for _ in range(index):
+            prefix.append(cells[0])
+            cells = cells[1]
+        self._cells = _cells_from(prefix + items, _drop(cells, removed))
+        self._len += len(items) - removed
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            tasks = list(self)
+            tasks[index] = value
+            self.__init__(tasks)
+        else:
+            self._replace(self._index(index), [value], 1)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            tasks = list(self)
+            del tasks[index]
+            self.__init__(tasks)
+        else:
+            self._replace(self._index(index), [], 1)
+
+    def insert(self, index, value):
+        if index < 0:
+            index = max(0, index + self._len)
+        self._replace(min(index, self._len), [value], 0)
+
+    def extend(self, values):
+        self._replace(self._len, list(values), 0)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def clear(self):
+        self._cells = None
+        self._len = 0
+
+    def __add__(self, other):
+        if isinstance(other, Agenda):
+            return Agenda._make(_cells_from(list(self), other._cells), self._len + other._len)
+        if isinstance(other, (list, tuple)):
+            return Agenda(list(self) + list(other))
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (list, tuple)):
+            return Agenda._make(_cells_from(other, self._cells), len(other) + self._len)
+        return NotImplemented
+
+    def __eq__(self, other):
+        if isinstance(other, Agenda):
+            return self._cells is other._cells or (self._len == other._len and list(self) == list(other))
+        if isinstance(other, (list, tuple)):
+            return self._len == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __reduce__(self):
+        return Agenda, (list(self),)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class PlanHistory(Sequence):
+    """
+    Actions done by an agent, oldest first. Appending an action and getting the last actions (plan[-n]) cost
+    O(1) and O(n), iterating from the oldest action needs to first go through all of them.
+    """
+    __slots__ = ("_cells", "_len")
+
+    def __init__(self, actions=()):
+        self._cells = None
+        self._len = 0
+        self.extend(actions)
+
+    def copy(self):
+        new = PlanHistory.__new__(PlanHistory)
+        new._cells = self._cells
+        new._len = self._len
+        return new
+
+    def append(self, action):
+        self._cells = (action, self._cells)
+        self._len += 1
+
+    def extend(self, actions):
+        for action in actions:
+            self.append(action)
+
+    def __len__(self):
+        return self._len
+
+    def __reversed__(self):
+        return _iter_cells(self._cells)
+
+    def __iter__(self):
+        return reversed(list(reversed(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += self._len
+        if index < 0 or index >= self._len:
+            raise IndexError("plan index out of range")
+        return _drop(self._cells, self._len - 1 - index)[0]
+
+    def __eq__(self, other):
+        if isinstance(other, (PlanHistory, list, tuple)):
+            return self._len == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return PlanHistory, (list(self),)
+
+    def __repr__(self):
+        return repr(list(self))
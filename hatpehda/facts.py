@@ -0,0 +1,328 @@
+"""
+Compiled representation of the states as sets of facts.
+
+The properties of the domain states are mostly dicts of lists keyed by individuals, e.g.
+    state.isHolding = {"human": ["mug"], "robot": []}
+which is the set of facts (relation, subject, object) {("isHolding", "human", "mug")}. A FactIndex interns each fact
+to an integer, so a set of facts is stored as a bitset (FactSet): the set operations, equality, hashing, the
+applicability checks (preconditions <= facts) and the application of effects ((facts - delete) | add) are then done
+on whole bitsets at once. The bitsets are Python integers, or NumPy bool arrays with backend="numpy" when NumPy is
+installed.
+holds(), add_fact() and delete_fact() test and change the facts of a State directly, they are used by the operators
+declared by their preconditions and effects (see operator() in hatpehda.py).
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_COLLECTIONS = (list, set, frozenset, tuple)
+
+
+class FactIndex:
+    """
+    Interns facts and converts states to and from FactSets. The shape of the properties of the converted states
+    (which subjects they have, whether their values are collections) is remembered to convert FactSets back to states.
+    Converting a list gives its elements back in the order their facts were first interned, not in their original order.
+    """
+    def __init__(self, backend="int"):
+        if backend not in ("int", "numpy"):
+            raise ValueError("Unknown fact set backend '{}', expected 'int' or 'numpy'".format(backend))
+        if backend == "numpy" and np is None:
+            raise ImportError("The numpy fact set backend needs NumPy to be installed")
+        self.backend = backend
+        self.ids = {}  # fact -> id
+        self.facts = []  # id -> fact
+        # relation -> type of the collections of its values, or None, for each subject (or for the property itself
+        # if it is not a dict)
+        self.shapes = {}
+
+    def __len__(self):
+        return len(self.facts)
+
+    def intern(self, fact):
+        fact_id = self.ids.get(fact)
+        if fact_id is None:
+            fact_id = self.ids[fact] = len(self.facts)
+            self.facts.append(fact)
+        return fact_id
+
+    def encode(self, facts):
+        """FactSet of an iterable of (relation, subject, object) facts."""
+        ids = [self.intern(fact) for fact in facts]
+        if self.backend == "numpy":
+            bits = np.zeros(len(self.facts), dtype=bool)
+            bits[ids] = True
+            return FactSet(self, bits)
+        bits = 0
+        for fact_id in ids:
+            bits |= 1 << fact_id
+        return FactSet(self, bits)
+
+    def from_state(self, state, relations=None):
+        """
+        FactSet of the properties of state named in relations (by default its dynamic properties, or all of them).
+        A property which is not a dict gives facts with a None subject.
+        """
+        if relations is None:
+            if state.__dynamic_props__ != []:
+                relations = state.__dynamic_props__
+            else:
+                relations = [name for name in vars(state) if not name.startswith("__")]
+                relations.extend(name for name in state.__dict__.get("__shared_props__", {}) if name not in relations)
+        facts = []
+        for relation in relations:
+            value = state.peek(relation)
+            if isinstance(value, dict):
+                shape = self.shapes.setdefault(relation, {})
+                if not isinstance(shape, dict):
+                    raise TypeError("Property '{}' was not a dict in a previously converted state".format(relation))
+                for subject, objects in value.items():
+                    facts.extend(self._facts(relation, subject, objects, shape))
+            else:
+                shape = self.shapes.setdefault(relation, _collection_type(value))
+                facts.extend(self._facts(relation, None, value, None))
+        return self.encode(facts)
+
+    @staticmethod
+    def _facts(relation, subject, objects, shape):
+        if shape is not None:
+            shape.setdefault(subject, _collection_type(objects))
+        if isinstance(objects, _COLLECTIONS):
+            return [(relation, subject, o) for o in objects]
+        return [(relation, subject, objects)]
+
+    def to_state(self, fact_set, state):
+        """Sets the properties of state (a State) known by this index to the content of fact_set, returns state."""
+        values = {}
+        for relation, shape in self.shapes.items():
+            if isinstance(shape, dict):
+                values[relation] = {subject: [] if kind is not None else None for subject, kind in shape.items()}
+            else:
+                values[relation] = [] if shape is not None else None
+        for relation, subject, obj in fact_set:
+            shape = self.shapes[relation]
+            if isinstance(shape, dict):
+                if shape.get(subject) is not None:
+                    values[relation].setdefault(subject, []).append(obj)
+                else:
+                    values[relation][subject] = obj
+            elif shape is not None:
+                values[relation].append(obj)
+            else:
+                values[relation] = obj
+        for relation, value in values.items():
+            shape = self.shapes[relation]
+            if isinstance(shape, dict):
+                value = {subject: _as_collection(objects, shape.get(subject)) for subject, objects in value.items()}
+            else:
+                value = _as_collection(value, shape)
+            setattr(state, relation, value)
+        return state
+
+    def applicable(self, fact_sets, preconditions):
+        """For each of fact_sets, whether it contains preconditions, computed at once with the numpy backend."""
+        if self.backend == "numpy" and fact_sets:
+            size = len(self.facts)
+            matrix = np.stack([fact_set._array(size) for fact_set in fact_sets])
+            return list(np.all(matrix | ~preconditions._array(size), axis=1))
+        return [preconditions <= fact_set for fact_set in fact_sets]
+
+
+def holds(state, fact):
+    """
+    Whether the fact (relation, subject, object) holds in state: the object is in the collection state.relation[subject]
+    or is its value. The subject None stands for the property itself, as in the facts of the non dict properties.
+    """
+    relation, subject, obj = fact
+    value = state.peek(relation)
+    if subject is not None:
+        if subject not in value:
+            return False
+        value = value[subject]
+    if isinstance(value, _COLLECTIONS):
+        return obj in value
+    return value == obj
+
+
+def add_fact(state, fact):
+    """
+    Adds the object of fact to the collection of its relation and subject in state (a new list if the subject is not
+    in the relation yet), or makes it their value if they have none. A value which is not a collection has to be
+    deleted before another object is added.
+    """
+    _change(state, fact, _added)
+
+
+def delete_fact(state, fact):
+    """Removes the object of fact from the collection of its relation and subject in state, or unsets their value."""
+    _change(state, fact, _deleted)
+
+
+def _change(state, fact, change):
+    relation, subject, obj = fact
+    if subject is None:
+        value = getattr(state, relation, None)
+        new_value = change(value, obj)
+        if new_value is not value:
+            setattr(state, relation, new_value)
+    else:
+        values = getattr(state, relation)
+        if subject not in values:
+            if change is _added:
+                values[subject] = [obj]
+            return
+        value = values[subject]
+        new_value = change(value, obj)
+        if new_value is not value:
+            values[subject] = new_value
+
+
+def _added(value, obj):
+    """value with obj added: the same list or set, modified, or a new value."""
+    if isinstance(value, list):
+        if obj not in value:
+            value.append(obj)
+        return value
+    if isinstance(value, set):
+        value.add(obj)
+        return value
+    if isinstance(value, tuple):
+        return value if obj in value else value + (obj,)
+    if isinstance(value, frozenset):
+        return value | {obj}
+    if value is not None and value != obj:
+        raise ValueError("Cannot add {!r} to the value {!r}, which is not a collection: it has to be deleted first"
+                         .format(obj, value))
+    return obj
+
+
+def _deleted(value, obj):
+    """value with obj removed: the same list or set, modified, or a new value."""
+    if isinstance(value, list):
+        if obj in value:
+            value.remove(obj)
+        return value
+    if isinstance(value, set):
+        value.discard(obj)
+        return value
+    if isinstance(value, tuple):
+        return tuple(v for v in value if v != obj)
+    if isinstance(value, frozenset):
+        return value - {obj}
+    return None if value == obj else value
+
+
+def _collection_type(value):
+    return type(value) if isinstance(value, _COLLECTIONS) else None
+
+
+def _as_collection(objects, collection_type):
+    if collection_type is None or collection_type is list:
+        return objects
+    return collection_type(objects)
+
+
+class FactSet:
+    """Immutable set of the facts of a FactIndex, only combinable with the fact sets of the same index."""
+    __slots__ = ("index", "bits")
+
+    def __init__(self, index, bits):
+        self.index = index
+        self.bits = bits
+
+    def _array(self, size):
+        """The numpy bits padded to size, the index having possibly interned new facts since this set was created."""
+        if len(self.bits) == size:
+            return self.bits
+        padded = np.zeros(size, dtype=bool)
+        padded[:len(self.bits)] = self.bits
+        return padded
+
+    def _combine(self, other, int_operation, array_operation):
+        if not isinstance(other, FactSet) or other.index is not self.index:
+            return NotImplemented
+        if self.index.backend == "numpy":
+            size = max(len(self.bits), len(other.bits))
+            return FactSet(self.index, array_operation(self._array(size), other._array(size)))
+        return FactSet(self.index, int_operation(self.bits, other.bits))
+
+    def __or__(self, other):
+        return self._combine(other, lambda a, b: a | b, lambda a, b: a | b)
+
+    def __and__(self, other):
+        return self._combine(other, lambda a, b: a & b, lambda a, b: a & b)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b, lambda a, b: a & ~b)
+
+    def __xor__(self, other):
+        return self._combine(other, lambda a, b: a ^ b, lambda a, b: a ^ b)
+
+    def apply(self, add=None, delete=None):
+        """The facts of this set, without the delete ones and with the add ones."""
+        result = self
+        if delete is not None:
+            result = result - delete
+        if add is not None:
+            result = result | add
+        return result
+
+    def __le__(self, other):
+        difference = self - other
+        if difference is NotImplemented:
+            return NotImplemented
+        return not difference
+
+    def __ge__(self, other):
+        if not isinstance(other, FactSet):
+            return NotImplemented
+        return other <= self
+
+    def __bool__(self):
+        if self.index.backend == "numpy":
+            return bool(self.bits.any())
+        return self.bits != 0
+
+    def __len__(self):
+        if self.index.backend == "numpy":
+            return int(self.bits.sum())
+        return bin(self.bits).count("1")
+
+    def _ids(self):
+        if self.index.backend == "numpy":
+            return np.flatnonzero(self.bits).tolist()
+        ids = []
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            ids.append(lowest.bit_length() - 1)
+            bits ^= lowest
+        return ids
+
+    def __iter__(self):
+        facts = self.index.facts
+        return (facts[i] for i in self._ids())
+
+    def __contains__(self, fact):
+        fact_id = self.index.ids.get(fact)
+        if fact_id is None:
+            return False
+        if self.index.backend == "numpy":
+            return fact_id < len(self.bits) and bool(self.bits[fact_id])
+        return (self.bits >> fact_id) & 1 == 1
+
+    def __eq__(self, other):
+        if not isinstance(other, FactSet) or other.index is not self.index:
+            return NotImplemented
+        return not (self ^ other)
+
+    def __hash__(self):
+        if self.index.backend == "numpy":
+            ids = np.flatnonzero(self.bits)
+            return hash(np.packbits(self.bits[:ids[-1] + 1]).tobytes()) if len(ids) else 0
+        return hash(self.bits)
+
+    def __repr__(self):
+        return "FactSet({})".format(sorted(self, key=repr))
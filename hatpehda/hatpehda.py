@@ -20,11 +20,32 @@ limitations under the License.
 from __future__ import print_function
 
 import copy
+import functools
+import heapq
+import inspect
+import os
 import sys
-from collections import namedtuple
+import time
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from enum import Enum
 from typing import Dict
 
+from .containers import Agenda, PlanHistory
+from .facts import add_fact, delete_fact, holds
+from .trail import Trail, track
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where the memory limit of the search budgets is then ignored
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # Only needed by PolicyGraph
+    np = None
+
 ############################################################
 # States and goals
 class HumanPredictionType(Enum):
@@ -35,33 +56,92 @@ human_prediction_type = HumanPredictionType.ALL_APPLICABLE_ACTIONS
 
 Plan = namedtuple("Plan", ["plan", "cost"])
 
+class _NoNext:
+    """Type of _NO_NEXT, pickled and copied as the same object."""
+    def __reduce__(self):
+        return "_NO_NEXT"
+
+_NO_NEXT = _NoNext()  # The next actions of a task, an empty list only created when needed
+
 class Task():
+    """
+    Node of the explored tree. The nodes use __slots__ and create their list of next actions only when it is needed,
+    as large explorations create hundreds of thousands of them. The parameters are stored as a tuple.
+    """
+    __slots__ = ("id", "name", "parameters", "agent", "why", "decompo_number", "applicable", "previous", "_next",
+                 "predecessor")
     __ID = 0
     def __init__(self, name, parameters, why, decompo_number, agent):
         self.id = Task.__ID
         Task.__ID += 1
         self.name = name
-        self.parameters = parameters
+        self.parameters = tuple(parameters)
         self.agent = agent
         self.why = why  # From which task it is decomposed
         self.decompo_number = decompo_number  # The number of the decomposition from the abstract task (self.why)
         self.applicable = True
         self.previous = None
-        self.next = []
+        self._next = _NO_NEXT
+        self.predecessor = None
+
+    @property
+    def next(self):
+        if self._next is _NO_NEXT:
+            self._next = []
+        return self._next
+
+    @next.setter
+    def next(self, next):
+        self._next = next
+
+    def has_next(self):
+        """Whether next contains actions, without creating the list."""
+        return self._next is not _NO_NEXT and bool(self._next)
+
+    def __copy__(self):
+        new = object.__new__(type(self))
+        for name in type(self)._all_slots():
+            setattr(new, name, getattr(self, name))
+        return new
+
+    @classmethod
+    def _all_slots(cls):
+        slots = cls.__dict__.get("_slots_cache")
+        if slots is None:
+            slots = tuple(name for c in reversed(cls.__mro__) for name in c.__dict__.get("__slots__", ()))
+            cls._slots_cache = slots
+        return slots
 
     def assign_next_id(self):
         self.id = Task.__ID
         Task.__ID += 1
 
+    @staticmethod
+    def get_next_id():
+        return Task.__ID
+
+    @staticmethod
+    def set_next_id(next_id):
+        """Sets the id of the next created task, used to give disjoint ranges of ids to different processes."""
+        Task.__ID = next_id
+
 class Operator(Task):
+    __slots__ = ("function", "cost", "probability")
+
     def __init__(self, name, parameters, agent, why, decompo_number, function):
         super().__init__(name, parameters, why, decompo_number, agent)
         self.function = function
         self.cost = 0.0
+        self.probability = 1.0  # Of a human action, among the actions predicted after the same robot action
 
     @staticmethod
     def copy_new_id(other):
-        new = copy.deepcopy(other)
+        """
+        Copy of other with a new id and no next actions. The parameters, the abstract task it comes from (why) and the
+        function are shared with other, they are never modified once the operator is created.
+        """
+        new = copy.copy(other)
+        new._next = _NO_NEXT
         new.assign_next_id()
         return new
 
@@ -69,18 +149,30 @@ class Operator(Task):
         return str((self.id, self.name, *self.parameters))
 
 class AbstractTask(Task):
+    __slots__ = ("how", "number_of_decompo")
+
     def __init__(self, name, parameters, agent, why, decompo_number, how, number_of_decompo):
         super().__init__(name, parameters, why, decompo_number, agent)
         self.how = how  # List of task networks this task has been decomposed into (after each decompo function has been called)
         self.number_of_decompo = number_of_decompo  # How many decomposition this task has (maybe not successful ones)
 
 class State():
-    """A state is just a collection of variable bindings."""
+    """
+    A state is just a collection of variable bindings.
+    Copies of a state are copy-on-write: the static properties are shared by reference between all the copies
+    (they must never be modified) and every other property is only copied the first time it is accessed in the copy.
+    fingerprint() hashes the dynamic properties, two states with the same properties having the same fingerprint.
+    The hash of a property is kept as long as the property is shared, so after a copy only the properties accessed
+    since are hashed again. Two states are equal when they have the same dynamic properties, the fingerprints being
+    compared first. As their hash is their fingerprint, states must not be modified while they are in a set or a dict.
+    """
 
     def __init__(self, name):
         self.__name__ = name
         self.__static_props__ = []
         self.__dynamic_props__ = []
+        self.__shared_props__ = {}  # Properties not copied yet, shared with the state this one was copied from
+        self.__hashes__ = {}  # Hashes of shared properties, valid as long as the property is shared
 
     def set_static_props(self, static_props):
         self.__static_props__ = static_props
@@ -88,6 +180,89 @@ class State():
     def set_dynamic_props(self, dynamic_props):
         self.__dynamic_props__ = dynamic_props
 
+    def __getattr__(self, name):
+        # Only called when the property is not owned by this state yet: copy it from the shared ones
+        shared = self.__dict__.get("__shared_props__")
+        if shared is None or name not in shared:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        value = copy.deepcopy(shared.pop(name))
+        self.__dict__[name] = value
+        self.__dict__["__hashes__"].pop(name, None)
+        return value
+
+    def peek(self, name):
+        """Value of a property without copying it if it is shared, it must not be modified."""
+        own = self.__dict__
+        if name not in own and name in own["__shared_props__"]:
+            return own["__shared_props__"][name]
+        return getattr(self, name)
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(self.__dict__.get("__shared_props__", ())))
+
+    def __deepcopy__(self, memo):
+        new = type(self).__new__(type(self))
+        memo[id(self)] = new
+        own = self.__dict__
+        shared = own["__shared_props__"]
+        hashes = own["__hashes__"]
+        for name in list(own):
+            if name not in _STATE_BOOKKEEPING and name not in own["__static_props__"]:
+                # This state gives up the ownership of its dynamic properties too, otherwise it could modify them
+                # after the copy has been made
+                shared[name] = own.pop(name)
+                hashes.pop(name, None)
+        new.__dict__.update(own)
+        new.__dict__["__shared_props__"] = dict(shared)
+        new.__dict__["__hashes__"] = dict(hashes)
+        return new
+
+    def __copy__(self):
+        new = type(self).__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new.__dict__["__shared_props__"] = dict(self.__shared_props__)
+        new.__dict__["__hashes__"] = dict(self.__hashes__)
+        return new
+
+    def fingerprint(self):
+        """Order independent combination (xor) of the hashes of the dynamic properties."""
+        own = self.__dict__
+        static_props = own["__static_props__"]
+        hashes = own["__hashes__"]
+        fingerprint = 0
+        for name, value in own.items():
+            if name not in _STATE_BOOKKEEPING and name not in static_props:
+                fingerprint ^= hash((name, _freeze(value)))
+        for name, value in own["__shared_props__"].items():
+            if name not in own and name not in static_props:
+                property_hash = hashes.get(name)
+                if property_hash is None:
+                    property_hash = hashes[name] = hash((name, _freeze(value)))
+                fingerprint ^= property_hash
+        return fingerprint
+
+    def __eq__(self, other):
+        if not isinstance(other, State):
+            return NotImplemented
+        return self is other or (self.fingerprint() == other.fingerprint() and
+                                 _state_fingerprint(self) == _state_fingerprint(other))
+
+    def __hash__(self):
+        return self.fingerprint()
+
+    def __getstate__(self):
+        return _state_vars(self)
+
+_STATE_BOOKKEEPING = {"__name__", "__static_props__", "__dynamic_props__", "__shared_props__", "__hashes__"}
+
+def _state_vars(state):
+    """All the properties of a state, including the ones not copied yet, without copying them."""
+    props = {n: v for n, v in state.__dict__["__shared_props__"].items() if n not in state.__dict__}
+    props.update((n, v) for n, v in state.__dict__.items() if n != "__shared_props__")
+    props["__shared_props__"] = {}
+    props["__hashes__"] = {}  # The hashes of strings are not the same in other processes
+    return props
+
 class Goal():
     """A goal is just a collection of variable bindings."""
 
@@ -99,8 +274,8 @@ class Goal():
 def print_state(state, indent=4):
     """Print each variable in state, indented by indent spaces."""
     if state != False:
-        for (name, val) in vars(state).items():
-            if state.__dynamic_props__==[] and name!='__name__' and name!='__static_props__' and name!='__dynamic_props__' or name in state.__dynamic_props__:
+        for (name, val) in _state_vars(state).items():
+            if state.__dynamic_props__==[] and name not in _STATE_BOOKKEEPING or name in state.__dynamic_props__:
                 for x in range(indent): sys.stdout.write(' ')
                 sys.stdout.write(state.__name__ + '.' + name)
                 print(' =', val)
@@ -139,16 +314,82 @@ def find_if(cond, seq):
 
 ############################################################
 # Commands to tell Pyhop what the operators and methods are
-class Agent:
-    def __init__(self, name):
-        self.name = name
+class Domain:
+    """
+    Operators, methods and triggers of an agent. They are never modified during the search, so every copy of
+    an agent made by the planner shares the same Domain instead of copying it.
+    """
+    def __init__(self):
         self.operators = {} # type: Dict[str, function]
         self.methods = {} # type: Dict[str, function]
+        self.triggers = []
+
+class Agent:
+    def __init__(self, name, domain=None):
+        self.name = name
+        self.domain = Domain() if domain is None else domain
         self.state = None
         self.goal = None
         self.tasks = []
         self.plan = []
-        self.triggers = []
+        # Index of trigger -> {property: value} read by the trigger when it last returned False, the trigger is not
+        # called again while these properties keep the same values (see trigger_reads). None to always call triggers.
+        self.quiet_triggers = {}
+
+    @property
+    def tasks(self):
+        return self._tasks
+
+    @tasks.setter
+    def tasks(self, tasks):
+        # The agenda of an agent is never the agenda of another one, they can only share their cells
+        self._tasks = tasks.copy() if isinstance(tasks, Agenda) else Agenda(tasks)
+
+    @property
+    def plan(self):
+        return self._plan
+
+    @plan.setter
+    def plan(self, plan):
+        self._plan = plan.copy() if isinstance(plan, PlanHistory) else PlanHistory(plan)
+
+    @property
+    def operators(self):
+        return self.domain.operators
+
+    @operators.setter
+    def operators(self, operators):
+        self.domain.operators = operators
+
+    @property
+    def methods(self):
+        return self.domain.methods
+
+    @methods.setter
+    def methods(self, methods):
+        self.domain.methods = methods
+
+    @property
+    def triggers(self):
+        return self.domain.triggers
+
+    @triggers.setter
+    def triggers(self, triggers):
+        self.domain.triggers = triggers
+
+    def __deepcopy__(self, memo):
+        # Only the search state of the agent is copied: the domain is shared, and the tasks of the agenda and
+        # the actions of the plan are never modified once created, so the persistent agenda and plan are shared
+        new = Agent.__new__(Agent)
+        memo[id(self)] = new
+        new.name = self.name
+        new.domain = self.domain
+        new.state = copy.deepcopy(self.state, memo)
+        new.goal = copy.deepcopy(self.goal, memo)
+        new._tasks = self._tasks.copy()
+        new._plan = self._plan.copy()
+        new.quiet_triggers = self.quiet_triggers  # Never modified, replaced by _check_triggers
+        return new
 
 agents = {}  # type: Dict[str, Agent]
 
@@ -189,14 +430,16 @@ def add_tasks(agent, tasks, to_agents=None):
         to_agents = agents
     if agent not in to_agents:
         to_agents[agent] = Agent(agent)
+    new_tasks = []
     for t in tasks:
         if t[0] in to_agents[agent].operators:
-            to_agents[agent].tasks.append(Operator(t[0], t[1:], agent, None, None, to_agents[agent].operators[t[0]]))
+            new_tasks.append(Operator(t[0], t[1:], agent, None, None, to_agents[agent].operators[t[0]]))
         elif t[0] in to_agents[agent].methods:
-            to_agents[agent].tasks.append(AbstractTask(t[0], t[1:], agent, None, None, [], len(to_agents[agent].methods[t[0]])))
+            new_tasks.append(AbstractTask(t[0], t[1:], agent, None, None, [], len(to_agents[agent].methods[t[0]])))
         else:
             raise TypeError("Asked to add task '{}' to agent '{}' but it is not defined "
                             "neither in its operators nor methods.".format(t[0], agent))
+    to_agents[agent].tasks.extend(new_tasks)
 
 def declare_triggers(agent, *triggers):
     if agent not in agents:
@@ -215,6 +458,7 @@ def reset_planner():
 ############################################################
 # Decorators for specific operators and methods functions
 def multi_decomposition(decompo):
+    @functools.wraps(decompo)  # Keeps the name of the decomposition, needed to pickle it
     def prepending(*args, **kwargs):
         result = decompo(*args, **kwargs)
         if result is False or result == [] or result is None:
@@ -222,6 +466,140 @@ def multi_decomposition(decompo):
         return "MULTI", result
     return prepending
 
+def likelihood(weight):
+    """
+    Decorator giving the relative likelihood (a positive weight, 1.0 by default) of an operator or a method of the
+    human. The probability of a predicted human action is the product of the likelihoods of its operator, of the
+    methods it comes from in the prediction and of their alternatives (see WeightedSubtasks), normalised over all the
+    actions predicted after the same robot action. select_conditional_plan then weights the mean cost over the human
+    actions by their probabilities, and a HumanBeam can prune the least probable ones.
+    """
+    if weight <= 0:
+        raise ValueError("The likelihood of an operator or a method must be positive, not {}".format(weight))
+    def weighing(function):
+        function.likelihood = weight
+        return function
+    return weighing
+
+class WeightedSubtasks(list):
+    """
+    Subtasks returned by a decomposition with their relative likelihood, e.g. for the alternatives of a multi
+    decomposition: [WeightedSubtasks(3.0, [("human_pick", "cube")]), WeightedSubtasks(1.0, [("human_wait",)])]
+    """
+    def __init__(self, likelihood, subtasks):
+        if likelihood <= 0:
+            raise ValueError("The likelihood of subtasks must be positive, not {}".format(likelihood))
+        super().__init__(subtasks)
+        self.likelihood = likelihood
+
+def operator(pre=(), absent=(), add=(), delete=(), cost=1.0):
+    """
+    Declares an operator by its preconditions and effects instead of the body of the decorated function, e.g.
+        @operator(pre=[("available", "zone", "?cube")], absent=[("isHolding", "human", "?cube")],
+                  add=[("isHolding", "?self_name", "?cube")], delete=[("available", "zone", "?cube")])
+        def robot_pick_cube(agents, self_state, self_name, cube):
+            pass
+    The facts (relation, subject, object) are the ones of hatpehda.facts, where "?name" stands for the value of the
+    parameter name of the function (self_name being the agent doing the action). The operator is applicable when the
+    pre facts hold and the absent ones do not hold in the agent state, its delete and then add effects are applied to
+    the states of all the agents. cost is a number or a function called like the operator before the effects.
+    The body of the decorated function is never called, only its name and parameters are used.
+    """
+    def declaring(function):
+        return OperatorSchema(function, pre, absent, add, delete, cost)
+    return declaring
+
+def trigger_reads(*properties):
+    """
+    Declares that the decorated trigger only reads these properties of the state of its agent (self_state), and
+    nothing else from the agents. Once the trigger has returned False, it is not called again until one of them is
+    written, i.e. until they are accessed in a copy of the state, the copies of the states being copy-on-write.
+    """
+    def declaring(trigger):
+        trigger.reads = frozenset(properties)
+        return trigger
+    return declaring
+
+def tracked_trigger(trigger):
+    """
+    Same as trigger_reads, but the properties read by the decorated trigger are recorded at each call, through a proxy
+    of self_state. The calls using the agents parameter are not recorded, the trigger being then always called again.
+    """
+    trigger.track_reads = True
+    return trigger
+
+class OperatorSchema:
+    """
+    Operator declared with operator(), called like the operator functions. The planner tests its applicability
+    without copying the agents and gets its effects without diffing states.
+    """
+    def __init__(self, function, pre, absent, add, delete, cost):
+        self.__name__ = function.__name__
+        self.__qualname__ = function.__qualname__
+        self.__module__ = function.__module__
+        self.__doc__ = function.__doc__
+        if hasattr(function, "likelihood"):
+            self.likelihood = function.likelihood
+        # The agent name and the task parameters, the first parameters being the agents and the agent state
+        self.parameters = list(inspect.signature(function).parameters)[2:]
+        self.pre = [self._compile(fact) for fact in pre]
+        self.absent = [self._compile(fact) for fact in absent]
+        self.add = [self._compile(fact) for fact in add]
+        self.delete = [self._compile(fact) for fact in delete]
+        self.cost = cost
+
+    def _compile(self, fact):
+        """Fact with each term replaced by (True, index of the parameter) for a "?parameter", or (False, constant)."""
+        if len(fact) != 3:
+            raise TypeError("Error: the fact {} of operator '{}' is not a (relation, subject, object) triple".format(
+                fact, self.__name__))
+        if isinstance(fact[0], str) and fact[0].startswith("?"):
+            raise TypeError("Error: the relation of the fact {} of operator '{}' must not be a parameter".format(
+                fact, self.__name__))
+        terms = []
+        for term in fact:
+            if isinstance(term, str) and term.startswith("?"):
+                if term[1:] not in self.parameters:
+                    raise TypeError("Error: the fact {} of operator '{}' uses '{}' which is not one of its parameters "
+                                    "{}".format(fact, self.__name__, term, self.parameters))
+                terms.append((True, self.parameters.index(term[1:])))
+            else:
+                terms.append((False, term))
+        return tuple(terms)
+
+    @staticmethod
+    def _bind(facts, values):
+        return [tuple(values[term] if is_parameter else term for is_parameter, term in fact) for fact in facts]
+
+    def applicable(self, state, agent_name, parameters):
+        values = (agent_name,) + tuple(parameters)
+        return (all(holds(state, fact) for fact in self._bind(self.pre, values)) and
+                not any(holds(state, fact) for fact in self._bind(self.absent, values)))
+
+    def effects(self, agent_name, parameters):
+        """The (add, delete) facts of the operator applied with parameters by agent_name."""
+        values = (agent_name,) + tuple(parameters)
+        return self._bind(self.add, values), self._bind(self.delete, values)
+
+    def __call__(self, agents, self_state, self_name, *parameters):
+        if not self.applicable(self_state, self_name, parameters):
+            return False
+        cost = self.cost(agents, self_state, self_name, *parameters) if callable(self.cost) else self.cost
+        add, delete = self.effects(self_name, parameters)
+        for ag in agents.values():
+            for fact in delete:
+                delete_fact(ag.state, fact)
+            for fact in add:
+                add_fact(ag.state, fact)
+        return agents, cost
+
+    def __reduce__(self):
+        # Pickled by name, as the decorated functions
+        return self.__qualname__
+
+    def __repr__(self):
+        return "<operator {}>".format(self.__name__)
+
 
 ############################################################
 # Commands to find out what the operators and methods are
@@ -278,167 +656,1373 @@ undesired_sequence_functions = []
 
 
 ############################################################
-# The actual planner
-def seek_plan_robot(agents: Dict[str, Agent], agent_name, sols, uncontrollable_agent_name = "human", fails=None, previous_action=None):
-    result = _seek_plan_robot(agents, agent_name, sols, uncontrollable_agent_name, fails, previous_action)
-
-    _merge_sols(sols)
-
-    # Add begin action for each solution
-    begin_action = Operator("BEGIN", [], uncontrollable_agent_name, None, None, None)
-    for s in sols:
-        first_action = get_first_action(s)
-        if first_action.name != "BEGIN":
-            first_action.predecessor = begin_action
-            first_action.previous = begin_action
-            if first_action not in begin_action.next:
-                begin_action.next.append(first_action)
-
-    return result
-
-def _seek_plan_robot(agents: Dict[str, Agent], agent_name, sols, uncontrollable_agent_name = "human", fails=None, previous_action=None):
-    if fails is None:
-        fails = []
-
-    # If robot agenda is empty
-    if agents[agent_name].tasks == []:
-        _backtrack_plan(agents[uncontrollable_agent_name].plan[-1])
-        sols.append(agents[uncontrollable_agent_name].plan[-1])
-        # print("=> BRANCH OVER <=")
-        return True
-
-    # Else, handle first task to do in the robot agenda
-    task = agents[agent_name].tasks[0]
-
-    # print("HATPEHDA> task = {} {} {}".format(task.agent, task.name, task.parameters))
-
-    # print("\nagenda = ", end='')
-    # for taski in agents[agent_name].tasks:
-    #     print(" {}{},".format(taski.name, taski.parameters), end='')
-    # print("")
-    # print_state(agents[agent_name].state)
-    # print("\ntreating task name={}".format(task.name))
-
-    # If the first task is an operator known by the robot
-    if task.name in agents[agent_name].operators:
-        # print("is an operator")
-
-        # CHECK IF FEASIBLE, AND IF SO THEN ADD IT TO THE ROBOT PLAN
-        # Get the operator and tries to apply it on a copy of agents
-        operator = agents[agent_name].operators[task.name]
-        newagents = copy.deepcopy(agents)
-        result = operator(newagents, newagents[agent_name].state, agent_name, *task.parameters)
+# Symmetries between interchangeable objects
+def declare_symmetries(*classes):
+    """
+    Declares classes of interchangeable objects (iterables of object names, e.g. identical mugs). When a node of the
+    search has several successors that are the same up to a permutation of objects of a class, and the joint state
+    (states and agendas of all the agents) of the node is unchanged by this permutation, only the first of these
+    successors is explored: for the robot, the other alternatives cannot lead to a cheaper policy, and for the human,
+    the probability of the others is added to the probability of the first one, so the mean costs are unchanged.
+    The operators, methods and triggers must not treat the objects of a class differently other than through the
+    states, and the order of the lists of the states must not matter. Called without classes, removes the symmetries.
+    The in-place search does not use the symmetries.
+    See detect_symmetries to find the classes from the static properties of a state.
+    """
+    global symmetry_classes
+    symmetry_classes = [list(objects) for objects in classes if len(objects) > 1]
+symmetry_classes = []
 
-        # if not feasible
-        if result == False:
-            #print(task.name + " not feasible...")
-            return False
+def detect_symmetries(state, objects):
+    """
+    Classes of the objects that can be interchanged in the static properties of state (all its properties if it has
+    no static properties declared), to be given to declare_symmetries.
+    """
+    names = state.__static_props__ if state.__static_props__ != [] else \
+        [n for n in _state_vars(state) if n not in _STATE_BOOKKEEPING]
+    properties = {name: state.peek(name) for name in names}
+    form = _renamed(properties, {})
+    classes = []
+    for o in objects:
+        for objects_class in classes:
+            r = objects_class[0]
+            if _renamed(properties, {o: r, r: o}) == form:
+                objects_class.append(o)
+                break
+        else:
+            classes.append([o])
+    return [objects_class for objects_class in classes if len(objects_class) > 1]
 
-        # else, if it's feasible
-        # set the cost of the operator
-        # remove the task from the robot agenda and put it in the robot plan
-        newagents[agent_name].tasks = newagents[agent_name].tasks[1:]
-        action = Operator.copy_new_id(task)
-        action.cost = result[1]
-        action.previous = previous_action
-        newagents[agent_name].plan.append(action)
+def _renamed(value, renaming):
+    """
+    Hashable representation of value with the strings of renaming renamed, the lists being compared regardless of
+    their order as are the dicts and sets.
+    """
+    if isinstance(value, str):
+        return renaming.get(value, value)
+    if isinstance(value, dict):
+        return frozenset((_renamed(k, renaming), _renamed(v, renaming)) for k, v in value.items())
+    if isinstance(value, (list, Agenda, PlanHistory)):
+        counts = {}
+        for v in value:
+            v = _renamed(v, renaming)
+            counts[v] = counts.get(v, 0) + 1
+        return "list", frozenset(counts.items())
+    if isinstance(value, tuple):
+        return tuple(_renamed(v, renaming) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_renamed(v, renaming) for v in value)
+    return _freeze(value)
+
+def _symmetric_form(agents, renaming):
+    """Hashable representation of the states and agendas of agents with the objects of renaming renamed."""
+    return tuple((name, _renamed({n: v for n, v in _state_vars(agents[name].state).items() if n not in _STATE_BOOKKEEPING},
+                                 renaming),
+                  tuple((t.agent, t.name, _renamed(tuple(t.parameters), renaming)) for t in agents[name].tasks))
+                 for name in sorted(agents))
+
+def _symmetry_orbits(agents, classes):
+    """
+    Representative of each object of classes that can be interchanged with at least another one in agents, i.e. the
+    joint state of agents is unchanged by swapping them. The objects interchangeable with each other have the same one.
+    """
+    form = _symmetric_form(agents, {})
+    orbits = {}
+    for objects in classes:
+        representatives = []
+        for o in objects:
+            for r in representatives:
+                if _symmetric_form(agents, {o: r, r: o}) == form:
+                    orbits[o] = orbits[r] = r
+                    break
+            else:
+                representatives.append(o)
+    return orbits
 
-        # CHECK TRIGGERS OF OTHER AGENTS
-        # check the triggers of every other agent than the robot
-        for a in agents:
-            if a == agent_name:
-                continue
-            for t in newagents[a].triggers:
-                triggered = t(newagents, newagents[a].state, a)
-                if triggered != False:
-                    triggered_subtasks = []
-                    for sub in triggered:
-                        if sub[0] in agents[a].methods:
-                            triggered_subtasks.append(AbstractTask(sub[0], sub[1:], a, None, None, [], len(newagents[a].methods[sub[0]])))
-                        elif sub[0] in agents[a].operators:
-                            triggered_subtasks.append(Operator(sub[0], sub[1:], a, None, None, newagents[a].operators[sub[0]]))
-                        else:
-                            raise TypeError(
-                                "Error: the trigger function '{}'"
-                                "returned a subtask '{}' which is neither in the methods nor in the operators "
-                                "of agent '{}'".format(t.__name__, sub[0], a)
-                            )
-                    newagents[a].tasks = triggered_subtasks + newagents[a].tasks
+def _relabeled(value, classes):
+    """
+    value (a nested tuple or list) with each object of classes (object -> class) replaced by its class and its rank
+    among the objects of its class in value, in order of appearance.
+    """
+    labels = {}
+    counts = {}
+    def relabel(value):
+        if isinstance(value, str):
+            label = labels.get(value)
+            if label is None and value in classes:
+                objects_class = classes[value]
+                label = labels[value] = ("__object__", objects_class, counts.get(objects_class, 0))
+                counts[objects_class] = label[2] + 1
+            return value if label is None else label
+        if isinstance(value, (list, tuple)):
+            return tuple(relabel(v) for v in value)
+        if isinstance(value, dict):
+            return tuple((relabel(k), relabel(v)) for k, v in value.items())
+        return _freeze(value)
+    return relabel(value)
+
+class _SymmetricSuccessors:
+    """
+    Finds the successors of the node of agents equivalent to a previous one, given in order by their signature (the
+    agendas and the action they start with). The interchangeable objects of the node are only computed once two
+    signatures are the same up to a permutation of the objects of classes.
+    """
+    def __init__(self, agents, classes):
+        self.agents = agents
+        self.classes = classes
+        self.objects = {o: i for i, objects in enumerate(classes) for o in objects}
+        self.orbits = None
+        self.signatures = []
+        self.seen = {}  # Relabeled signature -> index of the first successor with it
+
+    def add(self, signature):
+        """Index of the previous successor equivalent to the one of signature, or None."""
+        key = _relabeled(signature, self.objects if self.orbits is None else self.orbits)
+        if self.orbits is None and key in self.seen:
+            self.orbits = _symmetry_orbits(self.agents, self.classes)
+            self.seen = {}
+            for i, previous in enumerate(self.signatures):
+                self.seen[_relabeled(previous, self.orbits)] = i
+            key = _relabeled(signature, self.orbits)
+        self.signatures.append(signature)
+        index = self.seen.get(key)
+        if index is None:
+            self.seen[key] = len(self.signatures) - 1
+        return index
+
+def _agendas(agents):
+    return tuple((name, tuple((t.name, t.parameters) for t in agents[name].tasks)) for name in sorted(agents))
+
+def _without_symmetric_alternatives(search, agents, alternatives):
+    """The alternatives of the robot at the node of agents that are not equivalent to a previous one."""
+    successors = _SymmetricSuccessors(agents, search.symmetries)
+    for alternative in alternatives:
+        if successors.add(_agendas(alternative)) is None:
+            yield alternative
+        else:
+            search.pruned_symmetric_branches += 1
+
+def _merge_symmetric_human_actions(search, agents, possible_agents):
+    """
+    The possible agents after the human actions at the node of agents that are not equivalent to a previous one,
+    the probabilities of the others being added to the probability of the one they are equivalent to.
+    """
+    successors = _SymmetricSuccessors(agents, search.symmetries)
+    kept = []
+    for newagents in possible_agents:
+        action = newagents[search.uncontrollable_agent_name].plan[-1]
+        index = successors.add((action.name, action.parameters, _agendas(newagents)))
+        if index is None:
+            kept.append(newagents)
+        else:
+            possible_agents[index][search.uncontrollable_agent_name].plan[-1].probability += action.probability
+            search.pruned_symmetric_branches += 1
+    return kept
+
+
+############################################################
+# Search frontiers, deciding in which order the nodes are explored
+class DepthFirstFrontier:
+    """Explores the nodes in the same order as a recursive depth first search."""
+    def __init__(self):
+        self.nodes = []
+
+    def push(self, nodes):
+        self.nodes.extend(reversed(nodes))
+
+    def pop(self):
+        return self.nodes.pop()
+
+    def __len__(self):
+        return len(self.nodes)
+
+class BreadthFirstFrontier:
+    def __init__(self):
+        self.nodes = deque()
+
+    def push(self, nodes):
+        self.nodes.extend(nodes)
+
+    def pop(self):
+        return self.nodes.popleft()
+
+    def __len__(self):
+        return len(self.nodes)
+
+class BestFirstFrontier:
+    """Explores first the node with the lowest priority(node), nodes with the same priority in the order they were pushed."""
+    def __init__(self, priority):
+        self.priority = priority
+        self.nodes = []
+        self.pushed = 0
+
+    def push(self, nodes):
+        for node in nodes:
+            heapq.heappush(self.nodes, (self.priority(node), self.pushed, node))
+            self.pushed += 1
+
+    def pop(self):
+        return heapq.heappop(self.nodes)[2]
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+############################################################
+# Search budgets
+class SearchBudget:
+    """
+    Limits of a search: number of expanded nodes, depth of the nodes (counted in decompositions and actions from the
+    root), time in seconds and resident memory of the process in megabytes (where it cannot be read, see
+    current_memory, the increase of the peak resident memory since the start of the search). None means no limit.
+    When the number of nodes, the time or the memory is exceeded the search is interrupted; the nodes deeper than
+    max_depth are not expanded. The search is then incomplete.
+    With workers, each subtree is explored with the budget left when it is given to a worker (see remaining), and the
+    subtrees are dropped once the budget of the whole search is exceeded while collecting them. The memory limit
+    applies to each process.
+    """
+    def __init__(self, max_nodes=None, max_depth=None, max_time=None, max_memory=None):
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_time = max_time
+        self.max_memory = max_memory
+        self.deadline = None  # time.time() at which the search stops, for the subtrees explored by the workers
+
+    def exceeded(self, engine):
+        """Returns the name of the exceeded limit, or None."""
+        if self.max_nodes is not None and engine.expanded_nodes >= self.max_nodes:
+            return "nodes"
+        if self.max_time is not None and engine.elapsed_time() >= self.max_time:
+            return "time"
+        if self.deadline is not None and time.time() >= self.deadline:
+            return "time"
+        if self.max_memory is not None and engine.memory_usage() >= self.max_memory:
+            return "memory"
+        return None
+
+    def remaining(self, engine, depth):
+        """Budget left to explore the subtree of a node at depth, the time being left until the same deadline."""
+        budget = SearchBudget(max_memory=self.max_memory)
+        if self.max_nodes is not None:
+            budget.max_nodes = max(self.max_nodes - engine.expanded_nodes, 0)
+        if self.max_depth is not None:
+            budget.max_depth = self.max_depth - depth
+        budget.deadline = self.end_time(engine)
+        return budget
+
+    def end_time(self, engine):
+        """time.time() at which the search of engine has to stop, or None if the time is not limited."""
+        end_time = self.deadline
+        if self.max_time is not None:
+            time_limit = engine.start_time + self.max_time
+            end_time = time_limit if end_time is None else min(end_time, time_limit)
+        return end_time
+
+class HumanBeam:
+    """
+    Limits the human actions explored after each robot action to the most probable ones (see likelihood): at most
+    max_actions of them, and only the most probable ones until their cumulative probability reaches min_probability.
+    The most probable action is always explored. The probability of the actions pruned after a robot action is one
+    minus the sum of the probabilities of its next actions; the search statistics give the number of pruned actions
+    and the highest probability pruned after a robot action.
+    """
+    def __init__(self, max_actions=None, min_probability=None):
+        self.max_actions = max_actions
+        self.min_probability = min_probability
+
+    def select(self, possible_agents, agent_name):
+        """The agents of possible_agents after the explored actions of agent_name, in the same order."""
+        probabilities = [agents[agent_name].plan[-1].probability for agents in possible_agents]
+        kept = set()
+        cumulative = 0.0
+        for i in sorted(range(len(possible_agents)), key=lambda i: -probabilities[i]):
+            if kept and ((self.max_actions is not None and len(kept) >= self.max_actions) or
+                         (self.min_probability is not None and cumulative >= self.min_probability)):
+                break
+            kept.add(i)
+            cumulative += probabilities[i]
+        return [agents for i, agents in enumerate(possible_agents) if i in kept]
+
+def _prune_human_actions(search, possible_agents):
+    """The possible agents kept by the beam of search (a SearchEngine or a PolicySearch), counting the pruned ones."""
+    if search.beam is None:
+        return possible_agents
+    kept = search.beam.select(possible_agents, search.uncontrollable_agent_name)
+    if len(kept) < len(possible_agents):
+        search.pruned_human_actions += len(possible_agents) - len(kept)
+        pruned_probability = 1.0 - sum(agents[search.uncontrollable_agent_name].plan[-1].probability for agents in kept)
+        search.max_pruned_probability = max(search.max_pruned_probability, pruned_probability)
+    return kept
+
+def _relative_weights(probabilities):
+    """probabilities divided by the highest one, so equal probabilities weight exactly 1.0 each."""
+    highest = max(probabilities)
+    return [p / highest for p in probabilities]
+
+def current_memory():
+    """Resident memory of the process in megabytes, or None if it cannot be known (it is read from /proc)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def peak_memory():
+    """Peak resident memory of the process in megabytes, or 0.0 if it cannot be known."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class SearchResult:
+    """
+    Result of seek_plan_robot, true if the robot has a plan. When the search is not complete, because of its budget or
+    of its stop condition, the solutions are only the branches fully explored before it stopped.
+    """
+    def __init__(self, engine):
+        self.success = bool(engine.result)
+        self.complete = engine.is_complete()
+        self.stop_reason = engine.stop_reason
+        self.expanded_nodes = engine.expanded_nodes
+        self.cut_nodes = engine.cut_nodes
+        self.solutions = len(engine.sols)
+        self.max_depth = engine.max_depth
+        self.pruned_human_actions = engine.pruned_human_actions
+        self.max_pruned_probability = engine.max_pruned_probability
+        self.pruned_symmetric_branches = engine.pruned_symmetric_branches
+        self.pruned_interleavings = engine.pruned_interleavings
+        self.elapsed_time = engine.elapsed_time()
+        self.peak_memory = peak_memory()
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return "SearchResult(success={}, complete={}, stop_reason={}, expanded_nodes={}, cut_nodes={}, solutions={}, " \
+               "max_depth={}, pruned_human_actions={}, max_pruned_probability={:.3f}, pruned_symmetric_branches={}, " \
+               "pruned_interleavings={}, elapsed_time={:.3f}, peak_memory={:.1f})".format(
+                   self.success, self.complete, self.stop_reason, self.expanded_nodes, self.cut_nodes, self.solutions,
+                   self.max_depth, self.pruned_human_actions, self.max_pruned_probability,
+                   self.pruned_symmetric_branches, self.pruned_interleavings, self.elapsed_time, self.peak_memory)
+
+
+############################################################
+# The actual planner
+class SearchNode:
+    """
+    Agents waiting for the first task of the robot agenda to be handled, with the last action that led to them.
+    The cost is the sum of the costs of the actions from the root node.
+    """
+    def __init__(self, agents, previous_action, depth, cost, after_human_action=False):
+        self.agents = agents
+        self.previous_action = previous_action
+        self.depth = depth
+        self.cost = cost
+        self.after_human_action = after_human_action
+        self.single_response = False  # Whether the human action is the only one possible after the robot action
+        self.fingerprint = None
+
+class SearchEngine:
+    """
+    Explores the plans of the robot (agent_name) for each possible behaviour of the human with an explicit frontier
+    instead of recursive calls, so the search is not bounded by the recursion limit and can be interrupted and resumed.
+    The frontier decides the order of exploration: DepthFirstFrontier (default) gives the same exploration and the same
+    solutions, in the same order, as a recursive search. stop_condition is called with the engine before each node
+    expansion and interrupts the search when it returns True, e.g.:
+        lambda engine: engine.expanded_nodes >= 10000 or engine.elapsed_time() > 2.0
+    run() can then be called again to resume the search. A SearchBudget can be given as budget, it is checked like the
+    stop condition and also cuts the nodes deeper than its max_depth.
+    With workers=N, the subtrees of the nodes at parallel_depth (counted in decompositions and actions from the root)
+    are explored by a pool of N processes, each one with its own transposition table. The solutions are the same, in
+    the same order, as with a single process, only the ids of the actions differ. The domain functions must be
+    picklable, i.e. defined at the top level of a module. See SearchBudget for the budget of the subtrees.
+    human_prediction is the HumanPredictionType of the search, by default the module human_prediction_type.
+    With a HumanBeam as beam, only the most probable human actions are explored after each robot action.
+    symmetries are the classes of interchangeable objects whose permutations are not explored, by default the ones of
+    declare_symmetries.
+    With partial_order=True, the interleavings of independent robot and human actions are only explored once: a robot
+    action b done after the only possible human reaction h to a robot action a is not explored if an alternative of
+    the robot at the node of a, a', was followed by the only possible reaction h too, then by b', and the joint state
+    (states and agendas of all the agents) and the cost after a', h, b' are the same as after a, h, b (same names and
+    parameters). The policy of the robot could take a', h, b' instead for the same cost, so the policy selected by
+    select_conditional_plan is the same. The interleavings are not skipped when the human can react in several ways,
+    as the mean over the reactions does not commute with the choice of the robot. This cannot be used with undesired
+    sequence functions, as they depend on the order of the actions.
+    """
+    def __init__(self, agents: Dict[str, Agent], agent_name, sols, uncontrollable_agent_name="human",
+                 previous_action=None, frontier=None, stop_condition=None, transpositions=False, workers=None,
+                 parallel_depth=2, budget=None, human_prediction=None, beam=None, symmetries=None,
+                 partial_order=False):
+        self.agent_name = agent_name
+        self.uncontrollable_agent_name = uncontrollable_agent_name
+        self.human_prediction = human_prediction_type if human_prediction is None else human_prediction
+        self.beam = beam
+        self.symmetries = symmetry_classes if symmetries is None else symmetries
+        if partial_order and undesired_sequence_functions != []:
+            raise ValueError("The partial order reduction cannot be used with undesired sequence functions")
+        self.partial_order = partial_order
+        # (robot decision node, robot action, human action, robot action) -> (joint state fingerprint, cost) after
+        # the actions, for the sequences where the human action is the only possible reaction
+        self.interleavings = {} if partial_order else None
+        self.sols = sols
+        self.frontier = DepthFirstFrontier() if frontier is None else frontier
+        self.stop_condition = stop_condition
+        self.budget = budget
+        if (transpositions or workers is not None) and not isinstance(self.frontier, DepthFirstFrontier):
+            raise ValueError("The transposition table and the workers can only be used with a depth first exploration")
+        self.workers = workers if workers is not None and workers > 1 else None
+        self.parallel_depth = parallel_depth
+        self.subtrees_transpositions = transpositions
+        # The subtrees explored by the workers are not known until the end, so they cannot be transpositions
+        self.transpositions = {} if transpositions and self.workers is None else None
+        self.subtrees = []  # (index in sols, future of the solutions, node) of the subtrees given to the workers
+        self.links = _PlanLinks()
+        self.begin_action = Operator("BEGIN", [], uncontrollable_agent_name, None, None, None)
+        self.expanded_nodes = 0
+        self.cut_nodes = 0  # Not expanded because deeper than the budget max_depth
+        self.max_depth = 0
+        self.pruned_human_actions = 0
+        self.max_pruned_probability = 0.0
+        self.pruned_symmetric_branches = 0
+        self.pruned_interleavings = 0
+        self.interrupted = False
+        self.stop_reason = None
+        self.result = None
+        self.start_time = None
+        self.start_peak_memory = 0.0
+        self.frontier.push([SearchNode(agents, previous_action, 0, 0.0)])
+
+    def elapsed_time(self):
+        return 0.0 if self.start_time is None else time.time() - self.start_time
+
+    def start(self):
+        """Starts the clock of the search, the first time it is run."""
+        if self.start_time is None:
+            self.start_time = time.time()
+            self.start_peak_memory = peak_memory()
+
+    def memory_usage(self):
+        """Resident memory in megabytes, or the increase of the peak resident memory if it cannot be read."""
+        memory = current_memory()
+        if memory is None:
+            memory = peak_memory() - self.start_peak_memory
+        return memory
+
+    def is_over(self):
+        return len(self.frontier) == 0
+
+    def is_complete(self):
+        """Whether all the plans have been explored, i.e. the search is over and no node has been cut."""
+        return self.is_over() and self.cut_nodes == 0
+
+    def statistics(self):
+        return SearchResult(self)
+
+    def run(self):
+        """Explores until the frontier is empty or the stop condition is met, returns whether the root node could be expanded."""
+        for _ in self.iter_solutions():
+            pass
+        return self.result
+
+    def iter_solutions(self):
+        """Explores like run(), yielding the last action of each branch (also added to sols) as soon as it is found."""
+        self.start()
+        self.interrupted = False
+        self.stop_reason = None
+        executor = ProcessPoolExecutor(self.workers) if self.workers is not None else None
+        try:
+            while len(self.frontier) > 0:
+                if self.stop_condition is not None and self.stop_condition(self):
+                    self.interrupted = True
+                    self.stop_reason = "stop_condition"
                     break
+                if self.budget is not None:
+                    self.stop_reason = self.budget.exceeded(self)
+                    if self.stop_reason is not None:
+                        self.interrupted = True
+                        break
+                node = self.frontier.pop()
+                if node.agents is None:
+                    # All the successors of a transposition have been explored
+                    self.transpositions[node.fingerprint] = node.previous_action
+                    continue
+                if self.budget is not None and self.budget.max_depth is not None and node.depth > self.budget.max_depth:
+                    self.cut_nodes += 1
+                    continue
+                self.max_depth = max(self.max_depth, node.depth)
+                if executor is not None and node.depth >= self.parallel_depth and node.agents[self.agent_name].tasks != []:
+                    self.submit_subtree(executor, node)
+                    continue
+                nb_sols = len(self.sols)
+                result = self.expand(node)
+                if self.result is None:
+                    self.result = result
+                yield from self.sols[nb_sols:]
+            if executor is not None:
+                # The branches explored by the workers are only known at the end
+                local_sols = set(map(id, self.sols))
+                self.collect_subtrees()
+                yield from (s for s in self.sols if id(s) not in local_sols)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def submit_subtree(self, executor, node):
+        agents, previous_action = _detach_plans(node.agents, node.previous_action)
+        future = executor.submit(_explore_subtree, agents, self.agent_name, self.uncontrollable_agent_name,
+                                 previous_action, self.subtrees_transpositions,
+                                 self.budget.remaining(self, node.depth) if self.budget is not None else None,
+                                 self.human_prediction,
+                                 self.beam, self.symmetries, self.partial_order, _reserve_id_range())
+        self.subtrees.append((len(self.sols), future, node))
+        if self.result is None:
+            self.result = True
+
+    def collect_subtrees(self):
+        """Inserts the solutions of the subtrees explored by the workers where they would have been found by a single process."""
+        # The subtrees are collected in the order they would have been explored, the budget being checked between them
+        insertions = []
+        for index, future, node in self.subtrees:
+            result = self.subtree_result(future)
+            if result is None:
+                # Dropped, the budget of the whole search being exceeded
+                self.cut_nodes += 1
+                continue
+            subtree_sols, subtree_statistics = result
+            self.expanded_nodes += subtree_statistics.expanded_nodes
+            self.max_depth = max(self.max_depth, node.depth + subtree_statistics.max_depth)
+            self.pruned_human_actions += subtree_statistics.pruned_human_actions
+            self.max_pruned_probability = max(self.max_pruned_probability, subtree_statistics.max_pruned_probability)
+            self.pruned_symmetric_branches += subtree_statistics.pruned_symmetric_branches
+            self.pruned_interleavings += subtree_statistics.pruned_interleavings
+            if not subtree_statistics.complete:
+                self.cut_nodes += max(subtree_statistics.cut_nodes, 1)
+            if subtree_sols != [] and node.previous_action is not None:
+                # The branches start from a copy of the node previous action, without its predecessors, which is
+                # replaced by the original action (it is the only solution if the robot agenda was empty there)
+                copied_action = get_first_action(subtree_sols[0])
+                for action in copied_action.next:
+                    action.previous = node.previous_action
+                subtree_sols = [node.previous_action if action is copied_action else action for action in subtree_sols]
+            insertions.append((index, subtree_sols))
+        for index, subtree_sols in reversed(insertions):
+            self.sols[index:index] = subtree_sols
+        self.subtrees = []
+        # The next actions are linked once all the solutions are known, in the order they would have been found
+        _link_plans(self.sols)
+
+    def subtree_result(self, future):
+        """Solutions and statistics of a subtree, or None if the budget is exceeded before they are known."""
+        if self.budget is None:
+            return future.result()
+        reason = self.budget.exceeded(self)
+        if reason is None:
+            end_time = self.budget.end_time(self)
+            try:
+                return future.result(timeout=None if end_time is None else max(end_time - time.time(), 0.0))
+            except FutureTimeoutError:
+                reason = "time"
+        future.cancel()
+        self.stop_reason = reason
+        return None
+
+    def expand(self, node):
+        agents = node.agents
+        self.expanded_nodes += 1
+
+        if self.transpositions is not None and node.after_human_action and agents[self.agent_name].tasks != []:
+            node.fingerprint = _joint_state_fingerprint(agents)
+            known_action = self.transpositions.get(node.fingerprint)
+            if known_action is None:
+                self.transpositions[node.fingerprint] = _EXPLORING
+                # Popped once all the nodes pushed after it have been explored
+                end_marker = SearchNode(None, node.previous_action, node.depth, node.cost)
+                end_marker.fingerprint = node.fingerprint
+                self.frontier.push([end_marker])
+            elif known_action is not _EXPLORING:
+                if known_action.has_next():
+                    for successor in known_action.next:
+                        self.links.add_next(node.previous_action, successor)
+                    self.links.link(node.previous_action)
+                return True
+            # Else reached again on the branch being explored, it has to be explored again
+
+        # If robot agenda is empty
+        if agents[self.agent_name].tasks == []:
+            last_action = agents[self.uncontrollable_agent_name].plan[-1]
+            if self.workers is None:
+                self.links.link(last_action)
+            self.sols.append(last_action)
+            return True
+
+        # Else, handle first task to do in the robot agenda
+        task = agents[self.agent_name].tasks[0]
+
+        # If the first task is an operator known by the robot
+        if task.name in agents[self.agent_name].operators:
+            # Tries to apply it on a copy of agents, and if feasible adds it to the robot plan
+            newagents = _apply_operator(agents, self.agent_name, task, node.previous_action)
+            if newagents is False:
+                return False
+            action = newagents[self.agent_name].plan[-1]
+            if self.interleavings is not None and node.single_response and self.is_interleaving(node, action, newagents):
+                self.pruned_interleavings += 1
+                return True
+
+            # Get the next possible actions of the human, and plan for the robot after each of them
+            new_possible_agents = get_human_next_actions(newagents, self.uncontrollable_agent_name, previous_action=action,
+                                                         prediction_type=self.human_prediction)
+            if new_possible_agents == False:
+                # No action is feasible for the human
+                return False
+            if self.symmetries:
+                new_possible_agents = _merge_symmetric_human_actions(self, newagents, new_possible_agents)
+            new_possible_agents = _prune_human_actions(self, new_possible_agents)
+            children = []
+            for ag in new_possible_agents:
+                human_action = ag[self.uncontrollable_agent_name].plan[-1]
+                children.append(SearchNode(ag, human_action, node.depth + 1, node.cost + action.cost + human_action.cost,
+                                           after_human_action=True))
+            if len(children) == 1:
+                children[0].single_response = True
+            self.frontier.push(children)
+            return True
+
+        # Else if it's in the known methods of the robot, plan for each of its decompositions
+        if task.name in agents[self.agent_name].methods:
+            alternatives = _decompose(agents, self.agent_name, task)
+            if self.symmetries:
+                alternatives = _without_symmetric_alternatives(self, agents, alternatives)
+            children = [SearchNode(ag, node.previous_action, node.depth + 1, node.cost) for ag in alternatives]
+            for child in children:
+                child.single_response = node.single_response
+            if children == []:
+                # No decomposition is achievable for this task
+                return False
+            self.frontier.push(children)
+            return True
 
-        # MANAGE NEXT POSSIBLE HUMAN ACTION, PLAN WITH THEM
-        # Get the next possible actions of the human
-        new_possible_agents = get_human_next_actions(newagents, uncontrollable_agent_name, previous_action=action)
-        if new_possible_agents == False:
-            # No action is feasible for the human
-            #print("No action feasible for the human")
+        return False
+
+    def is_interleaving(self, node, action, agents):
+        """
+        Whether action, applied on agents after the only possible reaction of the human to the previous robot action,
+        is another interleaving of already explored actions (see partial_order). Otherwise, records it.
+        """
+        human_action = node.previous_action
+        previous_action = human_action.previous
+        decision = previous_action.previous  # The action after which the robot has chosen previous_action
+        after = (_joint_state_fingerprint(agents), node.cost + action.cost)
+        human_key = _action_key(human_action)
+        if self.interleavings.get((decision, _action_key(action), human_key, _action_key(previous_action))) == after:
+            return True
+        self.interleavings[(decision, _action_key(previous_action), human_key, _action_key(action))] = after
+        return False
+
+    def add_begin_action(self):
+        """Merges the solutions found so far and links their first action to a common BEGIN action."""
+        _merge_sols(self.sols)
+        for s in self.sols:
+            first_action = get_first_action(s)
+            if first_action.name != "BEGIN":
+                first_action.predecessor = self.begin_action
+                first_action.previous = self.begin_action
+                if first_action not in self.begin_action.next:
+                    self.begin_action.next.append(first_action)
+        return self.begin_action
+
+_ID_RANGE = 10 ** 12
+_reserved_id_ranges = 0
+
+def _reserve_id_range():
+    """First id of a range of ids that no other process uses."""
+    global _reserved_id_ranges
+    _reserved_id_ranges += 1
+    return _reserved_id_ranges * _ID_RANGE
+
+def _detach_plans(agents, previous_action):
+    """
+    Copies of agents and previous_action to send to another process. The actions in the plans are replaced by copies
+    without previous and next actions, otherwise all the already explored plans would be sent along.
+    """
+    copies = {}
+    def detach(action):
+        if id(action) not in copies:
+            new = copy.copy(action)
+            new.previous = None
+            new.next = []
+            copies[id(action)] = new
+        return copies[id(action)]
+    newagents = {}
+    for name, agent in agents.items():
+        newagents[name] = copy.copy(agent)
+        newagents[name].plan = [detach(a) for a in agent.plan]
+    return newagents, None if previous_action is None else detach(previous_action)
+
+def _explore_subtree(agents, agent_name, uncontrollable_agent_name, previous_action, transpositions, budget,
+                     human_prediction, beam, symmetries, partial_order, first_id):
+    """Run by the workers of a parallel search, returns the solutions of the subtree and the search statistics."""
+    Task.set_next_id(first_id)
+    sols = []
+    engine = SearchEngine(agents, agent_name, sols, uncontrollable_agent_name, previous_action,
+                          transpositions=transpositions, budget=budget, human_prediction=human_prediction, beam=beam,
+                          symmetries=symmetries, partial_order=partial_order)
+    engine.run()
+    return sols, engine.statistics()
+
+def seek_plan_robot(agents: Dict[str, Agent], agent_name, sols, uncontrollable_agent_name = "human", fails=None, previous_action=None,
+                    transpositions=False, frontier=None, stop_condition=None, workers=None, parallel_depth=2, budget=None,
+                    in_place=False, human_prediction=None, beam=None, partial_order=False):
+    """
+    Explores all the plans of the robot for each possible behaviour of the human and adds the last action of each
+    branch to sols. See SearchEngine for the frontier, stop_condition, workers, parallel_depth and budget parameters.
+    human_prediction is the HumanPredictionType used to predict the human actions, by default human_prediction_type:
+    FIRST_APPLICABLE_ACTION only explores the first action of the human, for fast online replanning. With a HumanBeam
+    as beam, only the most probable human actions are explored, see likelihood. With partial_order=True, the
+    interleavings of independent actions giving the same joint state are only explored once, see SearchEngine.
+    With in_place=True, the search is done by an InPlaceSearch, modifying the agents and undoing the modifications
+    instead of copying them, see the conditions on the domain there.
+    Returns a SearchResult, true if the robot has a plan, telling whether the search is complete, with its statistics.
+    With transpositions=True, a joint state (states and agendas of all the agents) reached a second time after a
+    human action is not explored again: the already explored actions are added to the next actions of the new human
+    action, turning the tree into a DAG whose nodes keep the first of their predecessors in 'previous'. This is only
+    valid if the operators, methods and triggers do not look at the plans of the agents.
+    """
+    engine = _search_engine(agents, agent_name, sols, uncontrollable_agent_name, previous_action, frontier, stop_condition,
+                            transpositions, workers, parallel_depth, budget, in_place, human_prediction, beam,
+                            partial_order)
+    engine.run()
+    engine.add_begin_action()
+    return engine.statistics()
+
+def _search_engine(agents, agent_name, sols, uncontrollable_agent_name, previous_action, frontier, stop_condition,
+                   transpositions, workers, parallel_depth, budget, in_place, human_prediction, beam, partial_order):
+    if not in_place:
+        return SearchEngine(agents, agent_name, sols, uncontrollable_agent_name, previous_action, frontier,
+                            stop_condition, transpositions, workers, parallel_depth, budget, human_prediction, beam,
+                            partial_order=partial_order)
+    if frontier is not None or transpositions or workers is not None or beam is not None or partial_order:
+        raise ValueError("The in-place search cannot use another frontier, the transpositions, the workers, a beam or "
+                         "the partial order reduction")
+    return InPlaceSearch(agents, agent_name, sols, uncontrollable_agent_name, previous_action, stop_condition, budget,
+                         human_prediction)
+
+def iter_plan_robot(agents: Dict[str, Agent], agent_name, uncontrollable_agent_name="human", previous_action=None,
+                    transpositions=False, frontier=None, stop_condition=None, workers=None, parallel_depth=2,
+                    budget=None, in_place=False, human_prediction=None, beam=None, partial_order=False):
+    """
+    Generator version of seek_plan_robot, yielding the last action of each branch as soon as the robot agenda of the
+    branch is empty. The previous actions of a yielded action are already linked to it, so the branch can be used
+    before the end of the search. Once the generator is exhausted the branches are linked to a common BEGIN action as
+    in seek_plan_robot; if it is closed before, the first actions of the branches have no previous action.
+    """
+    sols = []
+    engine = _search_engine(agents, agent_name, sols, uncontrollable_agent_name, previous_action, frontier, stop_condition,
+                            transpositions, workers, parallel_depth, budget, in_place, human_prediction, beam,
+                            partial_order)
+    yield from engine.iter_solutions()
+    engine.add_begin_action()
+
+def unsafe_in_place(function):
+    """
+    Decorator for the operators, methods and triggers that cannot be used by the in-place search (see InPlaceSearch),
+    e.g. because they modify objects of the states which are neither dicts, lists nor sets: the search then applies
+    them on a copy of the agents.
+    """
+    function.unsafe_in_place = True
+    return function
+
+class InPlaceSearch(SearchEngine):
+    """
+    Depth first search giving the same solutions, in the same order, as SearchEngine with its default frontier, but
+    modifying a single copy of the agents instead of copying them at each node: the modifications are recorded in an
+    undo trail (see the trail module) and undone when backtracking.
+    The operators, methods and triggers must only modify the agendas, the attributes of the states and the dicts,
+    lists and sets they contain. Dicts, lists and sets put in the states are replaced by tracked copies, so they must
+    be modified through the state after being put in it. The functions doing otherwise must be decorated with
+    unsafe_in_place. The search can be interrupted and resumed like SearchEngine, but not parallelised and it does not
+    use transpositions.
+    """
+    def __init__(self, agents: Dict[str, Agent], agent_name, sols, uncontrollable_agent_name="human",
+                 previous_action=None, stop_condition=None, budget=None, human_prediction=None):
+        super().__init__(agents, agent_name, sols, uncontrollable_agent_name, previous_action,
+                         stop_condition=stop_condition, budget=budget, human_prediction=human_prediction)
+        self.agents = _copy_agents_in_place(agents)
+        self.trail = Trail(self)
+        self.unsafe_triggers = any(getattr(t, "unsafe_in_place", False) for a in agents.values() for t in a.triggers)
+        self.generators = [self.explore(previous_action, 0)]  # Stack of the nodes being explored
+
+    def is_over(self):
+        return self.generators == []
+
+    def iter_solutions(self):
+        self.start()
+        self.interrupted = False
+        self.stop_reason = None
+        value = None
+        while self.generators != []:
+            if self.stop_condition is not None and self.stop_condition(self):
+                self.interrupted = True
+                self.stop_reason = "stop_condition"
+                break
+            if self.budget is not None:
+                self.stop_reason = self.budget.exceeded(self)
+                if self.stop_reason is not None:
+                    self.interrupted = True
+                    break
+            nb_sols = len(self.sols)
+            previous_trail = self.trail.activate()
+            try:
+                callee = self.generators[-1].send(value)
+                if self.result is None and len(self.generators) == 1:
+                    self.result = True  # The root node has been expanded
+                self.generators.append(callee)
+                value = None
+            except StopIteration as stop:
+                self.generators.pop()
+                value = stop.value
+                if self.result is None and self.generators == []:
+                    self.result = value
+            finally:
+                Trail.deactivate(previous_trail)
+            yield from self.sols[nb_sols:]
+
+    def mark(self, function):
+        """Marks the trail before calling function, on a copy of the agents if it is unsafe."""
+        self.trail.mark()
+        if self.unsafe_triggers or getattr(function, "unsafe_in_place", False):
+            self.agents = _copy_agents_in_place(self.agents)
+
+    def explore(self, previous_action, depth):
+        """Generator exploring the node of the current agents, yielding the generators exploring its children."""
+        if self.budget is not None and self.budget.max_depth is not None and depth > self.budget.max_depth:
+            self.cut_nodes += 1
             return False
+        self.max_depth = max(self.max_depth, depth)
+        self.expanded_nodes += 1
+        agents = self.agents
+
+        # If robot agenda is empty
+        if agents[self.agent_name].tasks == []:
+            last_action = agents[self.uncontrollable_agent_name].plan[-1]
+            self.links.link(last_action)
+            self.sols.append(last_action)
+            return True
 
-        # For each possible action of the human, plan for the robot
-        for ag in new_possible_agents:
-            # print(" H : {} {}".format(ag["human"].plan[-1].name, ag["human"].plan[-1].parameters))
-            _seek_plan_robot(ag, agent_name, sols, uncontrollable_agent_name, fails, previous_action=ag[uncontrollable_agent_name].plan[-1])
-        # print("robot plan:", newagents[agent_name].plan, "human plan:", newagents[uncontrollable_agent_name].plan)
-        return True
-
-    # Else if it's in the known methods of the robot
-    if task.name in agents[agent_name].methods:
-        # print("is a method")
-        # get the decompositions of the method
-        decompos = agents[agent_name].methods[task.name]
-        reachable_agents = []
-        # print("decompos= {}".format(decompos))
-        for i, decompo in enumerate(decompos):
-            newagentsdecompo = copy.deepcopy(agents)
-            result = decompo(newagentsdecompo, newagentsdecompo[agent_name].state, agent_name, *task.parameters)
-            if result is None:
-                raise TypeError(
-                    "Error: the decomposition function: {} of task {} has returned None. It should return a list or False.".format(decompo.__name__,  task.name))
-            if result != False:
-                multi_decompos = None
-                # print("result={}".format(result))
-                if result != [] and isinstance(result[0], str) and result[0] == "MULTI":
-                    multi_decompos = result[1]
+        task = agents[self.agent_name].tasks[0]
+        if task.name in agents[self.agent_name].operators:
+            action = self.apply_operator(self.agent_name, task, previous_action)
+            if action is None:
+                return False
+            for human_action in self.human_actions(action):
+                yield self.explore(human_action, depth + 1)
+            self.trail.undo()
+            return True
+
+        if task.name in agents[self.agent_name].methods:
+            decomposed = False
+            for _ in self.decompose(self.agent_name, task):
+                decomposed = True
+                yield self.explore(previous_action, depth + 1)
+            return decomposed
+
+        return False
+
+    def apply_operator(self, agent_name, task, previous_action):
+        """Marks the trail and applies the operator of task, returns the new action or None (the mark being undone)."""
+        if not _may_apply(self.agents, agent_name, task):
+            return None
+        self.mark(self.agents[agent_name].operators[task.name])
+        action = _apply_operator_in_place(self.agents, agent_name, task, previous_action)
+        if action is False:
+            self.trail.undo()
+            return None
+        return action
+
+    def decompose(self, agent_name, task):
+        """
+        Generator applying each decomposition of task, the first task of the agenda, undone when resumed.
+        Generates the product of the likelihoods of the decomposition function and of the subtasks.
+        """
+        for i, decompo in enumerate(self.agents[agent_name].methods[task.name]):
+            self.mark(decompo)
+            agents = self.agents
+            result = decompo(agents, agents[agent_name].state, agent_name, *task.parameters)
+            for subtasks in _decompositions(decompo, task, result):
+                self.trail.mark()
+                agents = self.agents
+                agents[agent_name].tasks = _subtasks(agents, agent_name, task, i, decompo, subtasks) + agents[agent_name].tasks[1:]
+                yield getattr(decompo, "likelihood", 1.0) * getattr(subtasks, "likelihood", 1.0)
+                self.trail.undo()
+            self.trail.undo()
+
+    def alternatives(self, agent_name):
+        """
+        Generator decomposing the agenda until it is empty or starts with an operator, undone when resumed.
+        Generates the product of the likelihoods of the decompositions (see likelihood).
+        """
+        end = object()
+        decompositions = [iter([1.0])]
+        weights = []  # Product of the likelihoods of the decompositions, for each generator of decompositions
+        while decompositions != []:
+            weight = next(decompositions[-1], end)
+            if weight is end:
+                decompositions.pop()
+                continue
+            weight *= weights[len(decompositions) - 2] if len(decompositions) > 1 else 1.0
+            del weights[len(decompositions) - 1:]
+            weights.append(weight)
+            agent = self.agents[agent_name]
+            if agent.tasks == [] or agent.tasks[0].name in agent.operators:
+                yield weight
+            elif agent.tasks[0].name in agent.methods:
+                decompositions.append(self.decompose(agent_name, agent.tasks[0]))
+
+    def human_actions(self, previous_action):
+        """Generator applying each possible action of the human, as get_human_next_actions, undone when resumed."""
+        first_only = self.human_prediction == HumanPredictionType.FIRST_APPLICABLE_ACTION
+        marks = len(self.trail.marks)
+        name = self.uncontrollable_agent_name
+        human = self.agents[name]
+        if human.tasks != [] and human.tasks[0].name not in human.operators and human.tasks[0].name not in human.methods:
+            raise Exception("Error during human HTN exploration")
+        found = False
+        actions = []
+        weights = []
+        for weight in self.alternatives(name):
+            human = self.agents[name]
+            if human.tasks == []:
+                action = self.apply_default_action("IDLE", previous_action)
+            else:
+                weight *= getattr(human.operators[human.tasks[0].name], "likelihood", 1.0)
+                action = self.apply_operator(name, human.tasks[0], previous_action)
+            if action is not None:
+                actions.append(action)
+                weights.append(weight)
+                yield action
+                found = True
+                self.trail.undo()
+            if found and first_only:
+                break
+        # The decompositions left by the break are not resumed, so they are undone here
+        while len(self.trail.marks) > marks:
+            self.trail.undo()
+        _set_probabilities(actions, weights)
+        if not found:
+            yield self.apply_default_action("WAIT", previous_action)
+            self.trail.undo()
+
+    def apply_default_action(self, name, previous_action):
+        """Marks the trail and adds an IDLE or WAIT action to the plan of the human, to be undone by the caller."""
+        self.trail.mark()
+        action = Operator(name, [], self.uncontrollable_agent_name, None, 0, None)
+        action.previous = previous_action
+        self.agents[self.uncontrollable_agent_name].plan.append(action)
+        return action
+
+def _copy_agents_in_place(agents):
+    """Copy of agents for the in-place search: the states own all their properties, with tracked containers."""
+    memo = {}
+    newagents = {}
+    for name, agent in agents.items():
+        new = Agent.__new__(Agent)
+        new.name = agent.name
+        new.domain = agent.domain
+        new.goal = copy.deepcopy(agent.goal, memo)
+        new.tasks = agent.tasks
+        new.plan = agent.plan
+        new.quiet_triggers = None  # The properties are modified in place, their values cannot tell they are unchanged
+        state = type(agent.state).__new__(type(agent.state))
+        for prop, value in _state_vars(agent.state).items():
+            if prop not in _STATE_BOOKKEEPING and prop not in agent.state.__static_props__:
+                value = track(copy.deepcopy(value, memo))
+            state.__dict__[prop] = value
+        new.state = state
+        newagents[name] = new
+    return newagents
+
+def _apply_operator(agents, agent_name, task, previous_action):
+    """
+    Applies the operator of task, the first task of the agenda of agent_name, on a copy of agents.
+    Returns the copy, with the new action at the end of the agent plan and the triggers of the other agents checked,
+    or False if the operator is not applicable.
+    """
+    if not _may_apply(agents, agent_name, task):
+        return False
+    newagents = copy.deepcopy(agents)
+    if _apply_operator_in_place(newagents, agent_name, task, previous_action) is False:
+        return False
+    return newagents
+
+def _may_apply(agents, agent_name, task):
+    """False if the operator of task is declarative and not applicable, without calling it."""
+    operator = agents[agent_name].operators[task.name]
+    return not isinstance(operator, OperatorSchema) or operator.applicable(agents[agent_name].state, agent_name,
+                                                                            task.parameters)
+
+def _apply_operator_in_place(agents, agent_name, task, previous_action):
+    """Same as _apply_operator, but modifies agents. Returns the new action or False."""
+    operator = agents[agent_name].operators[task.name]
+    result = operator(agents, agents[agent_name].state, agent_name, *task.parameters)
+    if result == False:
+        return False
+    # Set the cost of the operator, remove the task from the agenda and put it in the plan
+    agents[agent_name].tasks = agents[agent_name].tasks[1:]
+    action = Operator.copy_new_id(task)
+    action.cost = result[1]
+    action.previous = previous_action
+    agents[agent_name].plan.append(action)
+    _check_triggers(agents, agent_name)
+    return action
+
+def _check_triggers(agents, agent_name):
+    """
+    Checks the triggers of every other agent than agent_name, the first one triggered is added to the agent agenda.
+    The triggers having returned False whose read properties have not been written since (see trigger_reads) are
+    not called.
+    """
+    for a in agents:
+        if a == agent_name:
+            continue
+        quiet = agents[a].quiet_triggers
+        if quiet is not None:
+            quiet = agents[a].quiet_triggers = dict(quiet)
+        for i, t in enumerate(agents[a].triggers):
+            if quiet is None:
+                triggered = t(agents, agents[a].state, a)
+            else:
+                reads = quiet.get(i)
+                if reads is not None and _unchanged(agents[a].state, reads):
+                    continue
+                triggered, reads = _call_trigger(t, agents, a)
+                if triggered == False and reads is not None:
+                    quiet[i] = reads
                 else:
-                    multi_decompos = [result]
-                # print("multi_decompos={}".format(multi_decompos))
-                for multi_decompo in multi_decompos:
-                    # print("multi_decompo={}".format(multi_decompo))
-                    newagents = copy.deepcopy(newagentsdecompo)
-                    subtasks_obj = []
-                    for sub in multi_decompo:
-                        # print("sub={}".format(sub))
-                        if sub[0] in agents[agent_name].methods:
-                            subtasks_obj.append(AbstractTask(sub[0], sub[1:], agent_name, task, i, [], len(agents[agent_name].methods[sub[0]])))
-                        elif sub[0] in agents[agent_name].operators:
-                            subtasks_obj.append(Operator(sub[0], sub[1:], agent_name, task, i, agents[agent_name].operators[sub[0]]))
-                        else:
-                            raise TypeError(
-                                "Error: the decomposition function '{}' of task '{}' "
-                                "returned a subtask '{}' which is neither in the methods nor in the operators "
-                                "of agent '{}'".format(decompo.__name__, task.name, sub[0], agent_name)
-                            )
-                    # print("subtasks_obj={}".format(subtasks_obj))
-                    newagents[agent_name].tasks = subtasks_obj + newagents[agent_name].tasks[1:]
-                    reachable_agents.append(newagents)
-        if reachable_agents == []:
-            # No decomposition is achievable for this task
-            #print("No decompo found for the robot for task:", task.name)
-            #print("robot plan:", agents[agent_name].plan, "human plan:", agents[uncontrollable_agent_name].plan)
-            return False
+                    quiet.pop(i, None)
+            if triggered != False:
+                triggered_subtasks = []
+                for sub in triggered:
+                    if sub[0] in agents[a].methods:
+                        triggered_subtasks.append(AbstractTask(sub[0], sub[1:], a, None, None, [], len(agents[a].methods[sub[0]])))
+                    elif sub[0] in agents[a].operators:
+                        triggered_subtasks.append(Operator(sub[0], sub[1:], a, None, None, agents[a].operators[sub[0]]))
+                    else:
+                        raise TypeError(
+                            "Error: the trigger function '{}'"
+                            "returned a subtask '{}' which is neither in the methods nor in the operators "
+                            "of agent '{}'".format(t.__name__, sub[0], a)
+                        )
+                agents[a].tasks = triggered_subtasks + agents[a].tasks
+                break
+
+_MISSING = object()  # Value of the properties a state does not have
+
+def _unchanged(state, reads):
+    """Whether the properties of state still have the values read, i.e. they have not been copied since."""
+    for name, value in reads.items():
+        try:
+            if state.peek(name) is not value:
+                return False
+        except AttributeError:
+            if value is not _MISSING:
+                return False
+    return True
+
+def _call_trigger(trigger, agents, agent_name):
+    """
+    Calls trigger for agent_name, returns its result and the {property: value} it has read from the agent state,
+    or None if they are not known.
+    """
+    state = agents[agent_name].state
+    names = getattr(trigger, "reads", None)
+    if names is not None:
+        triggered = trigger(agents, state, agent_name)
+        reads = {}
+        for name in names:
+            try:
+                reads[name] = state.peek(name)
+            except AttributeError:
+                reads[name] = _MISSING
+        return triggered, reads
+    if getattr(trigger, "track_reads", False):
+        recording_agents = _RecordingAgents(agents)
+        recording_state = _RecordingState(state)
+        triggered = trigger(recording_agents, recording_state, agent_name)
+        return triggered, None if recording_agents.used else recording_state.reads
+    return trigger(agents, state, agent_name), None
+
+class _RecordingState:
+    """Proxy of a state recording the properties read through it."""
+    def __init__(self, state):
+        self.__dict__["state"] = state
+        self.__dict__["reads"] = {}
+
+    def __getattr__(self, name):
+        state = self.__dict__["state"]
+        try:
+            value = getattr(state, name)
+        except AttributeError:
+            self.__dict__["reads"][name] = _MISSING
+            raise
+        if name in state.__dict__:  # Not a method
+            self.__dict__["reads"][name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        raise TypeError("Triggers must not modify the states")
+
+class _RecordingAgents(Mapping):
+    """Proxy of the agents recording whether they are used."""
+    def __init__(self, agents):
+        self.agents = agents
+        self.used = False
+
+    def __getitem__(self, name):
+        self.used = True
+        return self.agents[name]
+
+    def __iter__(self):
+        self.used = True
+        return iter(self.agents)
+
+    def __len__(self):
+        self.used = True
+        return len(self.agents)
+
+def _decompose(agents, agent_name, task):
+    """
+    Generates, one at a time, a copy of agents for each decomposition of task, the first task of the agenda of
+    agent_name, where the task has been replaced by its subtasks.
+    """
+    for newagents, _ in _weighted_decompose(agents, agent_name, task):
+        yield newagents
+
+def _weighted_decompose(agents, agent_name, task, weight=1.0):
+    """
+    Same as _decompose, generating each copy of agents with weight multiplied by the likelihoods of the decomposition
+    function and of the subtasks it returned (see likelihood and WeightedSubtasks).
+    """
+    for i, decompo in enumerate(agents[agent_name].methods[task.name]):
+        newagentsdecompo = copy.deepcopy(agents)
+        result = decompo(newagentsdecompo, newagentsdecompo[agent_name].state, agent_name, *task.parameters)
+        decompo_weight = weight * getattr(decompo, "likelihood", 1.0)
+        for subtasks in _decompositions(decompo, task, result):
+            newagents = copy.deepcopy(newagentsdecompo)
+            newagents[agent_name].tasks = _subtasks(newagents, agent_name, task, i, decompo, subtasks) + newagents[agent_name].tasks[1:]
+            yield newagents, decompo_weight * getattr(subtasks, "likelihood", 1.0)
+
+def _decompositions(decompo, task, result):
+    """The lists of subtasks returned by a decomposition function."""
+    if result is None:
+        raise TypeError(
+            "Error: the decomposition function: {} of task {} has returned None. It should return a list or False.".format(decompo.__name__,  task.name))
+    if result == False:
+        return []
+    if result != [] and isinstance(result[0], str) and result[0] == "MULTI":
+        return result[1]
+    return [result]
+
+def _subtasks(agents, agent_name, task, decompo_number, decompo, subtasks):
+    """The tasks of the subtasks returned by the decompo_number-th decomposition function of task."""
+    subtasks_obj = []
+    for sub in subtasks:
+        if sub[0] in agents[agent_name].methods:
+            subtasks_obj.append(AbstractTask(sub[0], sub[1:], agent_name, task, decompo_number, [], len(agents[agent_name].methods[sub[0]])))
+        elif sub[0] in agents[agent_name].operators:
+            subtasks_obj.append(Operator(sub[0], sub[1:], agent_name, task, decompo_number, agents[agent_name].operators[sub[0]]))
         else:
-            for ag in reachable_agents:
-                _seek_plan_robot(ag, agent_name, sols, uncontrollable_agent_name, fails, previous_action)
-            return True
+            raise TypeError(
+                "Error: the decomposition function '{}' of task '{}' "
+                "returned a subtask '{}' which is neither in the methods nor in the operators "
+                "of agent '{}'".format(decompo.__name__, task.name, sub[0], agent_name)
+            )
+    return subtasks_obj
+
+_EXPLORING = object()  # Transposition table entry of a joint state whose exploration is not over yet
+
+def _freeze(value):
+    """Hashable representation of the content of a value, dict and set contents being order independent."""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, State):
+        return _state_fingerprint(value)
+    if isinstance(value, Goal):
+        return frozenset((k, _freeze(v)) for k, v in vars(value).items() if k != "__name__")
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        # Unknown mutable object, only equal to itself
+        return type(value).__name__, id(value)
+
+def _state_fingerprint(state):
+    """Exact hashable representation of the dynamic properties of state, see State.fingerprint() for a cheaper one."""
+    static_props = state.__static_props__
+    return frozenset((name, _freeze(val)) for name, val in _state_vars(state).items()
+                     if name not in _STATE_BOOKKEEPING and name not in static_props)
+
+def _action_key(action):
+    return action.agent, action.name, _freeze(action.parameters)
+
+class _StateKey:
+    """
+    Key of a state in the tables of the search, hashed by the fingerprint of the state. As different states can have
+    the same fingerprint, the keys with the same fingerprint are compared exactly, on a copy of the state taken when
+    the key is made (the copy only shares the properties, see State).
+    """
+    __slots__ = ("state", "fingerprint")
+
+    def __init__(self, state):
+        self.state = copy.deepcopy(state)
+        self.fingerprint = self.state.fingerprint()
+
+    def __hash__(self):
+        return self.fingerprint
+
+    def __eq__(self, other):
+        if not isinstance(other, _StateKey):
+            return NotImplemented
+        return self is other or (self.fingerprint == other.fingerprint and
+                                 _state_fingerprint(self.state) == _state_fingerprint(other.state))
+
+def _joint_state_fingerprint(agents):
+    """Hashable representation of the states and agendas of all the agents, see _StateKey."""
+    return tuple((name, _StateKey(agents[name].state),
+                  tuple((t.agent, t.name, _freeze(t.parameters)) for t in agents[name].tasks))
+                 for name in sorted(agents))
+
+class HumanPredictionCache:
+    """
+    Bounded LRU cache of the actions predicted by get_human_next_actions with ALL_APPLICABLE_ACTIONS, keyed by the
+    state (see _StateKey) and the agenda of the predicted agent. For each predicted action, it keeps the agenda obtained
+    by the decompositions, the action is then applied again on the agents with new tasks and actions ids.
+    The methods of the predicted agent must only depend on its state and agenda and not modify the states, and its
+    operators must be applicable whenever its state is the same. An action not applicable anymore is predicted again.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        # Key -> (agenda when predicted, first id of the tasks created by the prediction,
+        #         [(new tasks, starting with the action or None for IDLE, index of the rest of the agenda,
+        #           probability of the action)])
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-    return False
+    @staticmethod
+    def key(agents, agent_name):
+        agent = agents[agent_name]
+        return (agent_name, agent.domain, _StateKey(agent.state),
+                tuple((t.name, _freeze(t.parameters)) for t in agent.tasks))
+
+    def get(self, agents, agent_name, previous_action):
+        """The predicted agents, or None if they are not in the cache."""
+        key = self.key(agents, agent_name)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        solutions = _replay_prediction(agents, agent_name, previous_action, *entry)
+        if solutions is None:
+            self.misses += 1
+            del self.entries[key]
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return solutions
+
+    def put(self, agents, agent_name, solutions, first_id):
+        """Records the agents predicted by get_all_applicable_actions from agents, creating tasks from first_id."""
+        tasks = list(agents[agent_name].tasks)
+        positions = {id(t): i for i, t in enumerate(tasks)}
+        predictions = []
+        for newagents in solutions:
+            action = newagents[agent_name].plan[-1]
+            if action.name == "IDLE":
+                new_tasks = [None]
+            elif action.why is None or (action.why.id < first_id and id(action.why) not in positions):
+                new_tasks = [tasks[0]]  # The first task of the agenda has been applied without being decomposed
+            else:
+                new_tasks = [action]
+            k = len(tasks)
+            for t in newagents[agent_name].tasks:
+                if id(t) in positions:
+                    k = positions[id(t)]
+                    break
+                new_tasks.append(t)
+            predictions.append((new_tasks, k, action.probability))
+        self.entries[self.key(agents, agent_name)] = (tasks, first_id, predictions)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
 
-def get_human_next_actions(agents, agent_name, previous_action):
-    global human_prediction_type
-    if human_prediction_type == HumanPredictionType.FIRST_APPLICABLE_ACTION:
+def _replay_prediction(agents, agent_name, previous_action, tasks, first_id, predictions):
+    """
+    Agents obtained by applying again the predicted actions, their agenda being the new tasks followed by the tasks
+    of the current agenda from index k, the tasks of the agenda when predicted being replaced by the current ones and
+    the tasks created by the prediction by copies. None if one of the actions is not applicable.
+    """
+    current = list(agents[agent_name].tasks)
+    positions = {id(t): i for i, t in enumerate(tasks)}
+    solutions = []
+    for new_tasks, k, probability in predictions:
+        copies = {}
+        def renew(task):
+            if task is None:
+                return None
+            if id(task) in positions:
+                return current[positions[id(task)]]
+            if task.id < first_id:
+                return task
+            new = copies.get(id(task))
+            if new is None:
+                new = copies[id(task)] = copy.copy(task)
+                new._next = _NO_NEXT
+                new.previous = None
+                new.assign_next_id()
+                new.why = renew(task.why)
+            return new
+        newagents = copy.deepcopy(agents)
+        newagents[agent_name].tasks = [renew(t) for t in new_tasks[1:]] + agents[agent_name].tasks[k:]
+        if new_tasks[0] is None:
+            idle = Operator("IDLE", [], agent_name, None, 0, None)
+            idle.previous = previous_action
+            newagents[agent_name].plan.append(idle)
+        else:
+            newagents[agent_name].tasks = [renew(new_tasks[0])] + newagents[agent_name].tasks
+            if _apply_operator_in_place(newagents, agent_name, newagents[agent_name].tasks[0], previous_action) is False:
+                return None
+        newagents[agent_name].plan[-1].probability = probability
+        solutions.append(newagents)
+    return solutions
+
+def set_human_prediction_cache(max_size=10000):
+    """
+    Caches the human actions predicted during the searches (see HumanPredictionCache) in a cache of max_size entries,
+    returned to read its hits and misses. None disables the cache.
+    """
+    global human_prediction_cache
+    human_prediction_cache = None if max_size is None else HumanPredictionCache(max_size)
+    return human_prediction_cache
+human_prediction_cache = None
+
+def get_human_next_actions(agents, agent_name, previous_action, prediction_type=None):
+    """
+    Copies of agents after each action agent_name can do, as predicted by prediction_type (by default
+    human_prediction_type), or after a WAIT action if it cannot do anything.
+    """
+    if prediction_type is None:
+        prediction_type = human_prediction_type
+    if prediction_type == HumanPredictionType.FIRST_APPLICABLE_ACTION:
         sols = []
-        next_actions = get_first_applicable_action(agents, agent_name, sols)
-        if next_actions is False:
+        result = get_first_applicable_action(agents, agent_name, sols, previous_action=previous_action)
+        if result is False:
+            raise Exception("Error during human HTN exploration")
+        if sols == []:
             newagents = copy.deepcopy(agents)
             wait_action = Operator("WAIT", [], agent_name, None, 0, None)
             wait_action.previous = previous_action
@@ -446,11 +2030,21 @@ def get_human_next_actions(agents, agent_name, previous_action):
             return [newagents]
         else:
             return sols
-    elif human_prediction_type == HumanPredictionType.ALL_APPLICABLE_ACTIONS:
-        sols = []
-        result = get_all_applicable_actions(agents, agent_name, sols, previous_action=previous_action)
-        if result is False:
-            raise Exception("Error during human HTN exploration")
+    elif prediction_type == HumanPredictionType.ALL_APPLICABLE_ACTIONS:
+        sols = None
+        if human_prediction_cache is not None:
+            sols = human_prediction_cache.get(agents, agent_name, previous_action)
+        if sols is None:
+            sols = []
+            weights = []
+            first_id = Task.get_next_id()
+            result = get_all_applicable_actions(agents, agent_name, sols, previous_action=previous_action,
+                                                weights=weights)
+            if result is False:
+                raise Exception("Error during human HTN exploration")
+            _set_probabilities([newagents[agent_name].plan[-1] for newagents in sols], weights)
+            if human_prediction_cache is not None:
+                human_prediction_cache.put(agents, agent_name, sols, first_id)
         if sols == []:
             newagents = copy.deepcopy(agents)
             wait_action = Operator("WAIT", [], agent_name, None, 0, None)
@@ -460,192 +2054,703 @@ def get_human_next_actions(agents, agent_name, previous_action):
         else:
             return sols
 
-def get_all_applicable_actions(agents, agent_name, solutions, previous_action):
-    if agents[agent_name].tasks == []:
-        newagents = copy.deepcopy(agents)
-        idle = Operator("IDLE", [], agent_name, None, 0, None)
-        idle.previous = previous_action
-        newagents[agent_name].plan.append(idle)
-        solutions.append(newagents)
-        return
-    task = agents[agent_name].tasks[0]
-    if task.name in agents[agent_name].operators:
-        operator = agents[agent_name].operators[task.name]
-        newagents = copy.deepcopy(agents)
-        result = operator(newagents, newagents[agent_name].state, agent_name, *task.parameters)
-        if result == False:
-            return
-        newagents[agent_name].tasks = newagents[agent_name].tasks[1:]
-        action = Operator.copy_new_id(task)
-        action.cost = result[1]
-        action.previous = previous_action
-        newagents[agent_name].plan.append(action)
-        for a in agents:
-            if a == agent_name:
-                continue
-            for t in newagents[a].triggers:
-                triggered = t(newagents, newagents[a].state, a)
-                if triggered != False:
-                    triggered_subtasks = []
-                    for sub in triggered:
-                        if sub[0] in newagents[a].methods:
-                            triggered_subtasks.append(AbstractTask(sub[0], sub[1:], a, None, None, [], len(newagents[a].methods[sub[0]])))
-                        elif sub[0] in newagents[a].operators:
-                            triggered_subtasks.append(Operator(sub[0], sub[1:], a, None, None, newagents[a].operators[sub[0]]))
-                        else:
-                            raise TypeError(
-                                "Error: the trigger function '{}'"
-                                "returned a subtask '{}' which is neither in the methods nor in the operators "
-                                "of agent '{}'".format(t.__name__, sub[0], a)
-                            )
-                    newagents[a].tasks = triggered_subtasks + newagents[a].tasks
-                    break
-        solutions.append(newagents)
-        return
-    if task.name in agents[agent_name].methods:
-        decompos = agents[agent_name].methods[task.name]
-        for i, decompo in enumerate(decompos):
-            newagentsdecompo = copy.deepcopy(agents)
-            result = decompo(newagentsdecompo, newagentsdecompo[agent_name].state, agent_name, *task.parameters)
-            if result != False:
-                subtaskss = None
-                if result != [] and isinstance(result[0], str) and result[0] == "MULTI":
-                    subtaskss = result[1]
-                else:
-                    subtaskss = [result]
-                for subtasks in subtaskss:
-                    newagents = copy.deepcopy(newagentsdecompo)
-                    subtasks_obj = []
-                    for sub in subtasks:
-                        if sub[0] in agents[agent_name].methods:
-                            subtasks_obj.append(AbstractTask(sub[0], sub[1:], agent_name, task, i, [], len(agents[agent_name].methods[sub[0]])))
-                        elif sub[0] in agents[agent_name].operators:
-                            subtasks_obj.append(Operator(sub[0], sub[1:], agent_name, task, i, agents[agent_name].operators[sub[0]]))
-                        else:
-                            raise TypeError(
-                                "Error: the decomposition function '{}' of task '{}' "
-                                "returned a subtask '{}' which is neither in the methods nor in the operators "
-                                "of agent '{}'".format(decompo.__name__, task.name, sub[0], agent_name)
-                            )
-                    newagents[agent_name].tasks = subtasks_obj + newagents[agent_name].tasks[1:]
-                    get_all_applicable_actions(newagents, agent_name, solutions, previous_action)
-        return
-    #print("looking for:", task.name, "not a task nor an action of agent", agent_name)
-    return False
-
-def get_first_applicable_action(agents, agent_name, solutions):
-    raise NotImplementedError("Not implemented yet.")
-
-def _backtrack_plan(last_action):
-    action = last_action
-    while action is not None:
-        if action.previous is not None and action not in action.previous.next:
-            action.previous.next.append(action)
-        action = action.previous
+def _set_probabilities(actions, weights):
+    """Sets the probability of each of actions to its weight normalised over all of them."""
+    total = sum(weights)
+    for action, weight in zip(actions, weights):
+        action.probability = weight / total
+
+def get_all_applicable_actions(agents, agent_name, solutions, previous_action, first_only=False, weights=None):
+    """
+    Adds to solutions a copy of agents for each first action agent_name can do by decomposing its agenda, or only for
+    the first one found if first_only. The decompositions are explored depth first with a stack of generators rather
+    than recursive calls. Returns False if the first task of the agenda is neither an operator nor a method.
+    If weights is a list, the unnormalised likelihood of each solution is added to it (see likelihood).
+    """
+    root_agents = agents
+    decompositions = [iter([(agents, 1.0)])]
+    while decompositions != []:
+        agents, weight = next(decompositions[-1], (None, None))
+        if agents is None:
+            decompositions.pop()
+            continue
+        if agents[agent_name].tasks == []:
+            newagents = copy.deepcopy(agents)
+            idle = Operator("IDLE", [], agent_name, None, 0, None)
+            idle.previous = previous_action
+            newagents[agent_name].plan.append(idle)
+            solutions.append(newagents)
+            if weights is not None:
+                weights.append(weight)
+            if first_only:
+                return
+            continue
+        task = agents[agent_name].tasks[0]
+        if task.name in agents[agent_name].operators:
+            newagents = _apply_operator(agents, agent_name, task, previous_action)
+            if newagents is not False:
+                solutions.append(newagents)
+                if weights is not None:
+                    weights.append(weight * getattr(agents[agent_name].operators[task.name], "likelihood", 1.0))
+                if first_only:
+                    return
+            continue
+        if task.name in agents[agent_name].methods:
+            decompositions.append(_weighted_decompose(agents, agent_name, task, weight))
+            continue
+        #print("looking for:", task.name, "not a task nor an action of agent", agent_name)
+        if agents is root_agents:
+            return False
+
+def get_first_applicable_action(agents, agent_name, solutions, previous_action=None):
+    """
+    Adds to solutions a copy of agents for the first action agent_name can do, the first one of
+    get_all_applicable_actions: the decomposition of the agenda stops at the first applicable operator.
+    """
+    return get_all_applicable_actions(agents, agent_name, solutions, previous_action, first_only=True)
+
+class _PlanLinks:
+    """
+    Adds the actions of the branches to the next actions of their previous action as the branches are found. Each
+    action is walked through once, the next actions being indexed by id instead of searched.
+    """
+    def __init__(self):
+        self.next_ids = {}  # Id of an action -> ids of the actions in its next actions
+        self.linked = set()  # Ids of the actions added to the next actions of their previous action
+
+    def add_next(self, previous, action):
+        """Adds action to the next actions of previous, if it is not already there."""
+        ids = self.next_ids.get(id(previous))
+        if ids is None:
+            ids = self.next_ids[id(previous)] = {id(a) for a in previous.next}
+        if id(action) not in ids:
+            ids.add(id(action))
+            previous.next.append(action)
+
+    def link(self, last_action):
+        """Links each action of the branch ending with last_action, up to the first action already linked."""
+        action = last_action
+        while action.previous is not None and id(action) not in self.linked:
+            self.linked.add(id(action))
+            self.add_next(action.previous, action)
+            action = action.previous
+
+def _link_plans(sols):
+    """
+    Links the branches ending with the actions of sols, in order, for branches which may have been linked up to a
+    copy of one of their actions (see SearchEngine.collect_subtrees).
+    """
+    links = _PlanLinks()
+    for action in sols:
+        links.link(action)
 
 def _merge_sols(sols):
-    tasks = {}
+    """
+    Merges the branches ending with the actions of sols: the previous actions with the same id are replaced by the
+    first one found, to which the next actions are added. Each action is walked through once, the branches being
+    followed up to an action already walked through, and the next actions being indexed by id.
+    """
+    tasks = {}  # Id -> first action found with this id
+    next_ids = {}  # Id -> ids of the next actions of the action in tasks
+    visited = set()
     for sol in sols:
         primitive = sol
-        while primitive.previous is not None:
-            if primitive.previous.id not in tasks:
-                tasks[primitive.previous.id] = primitive.previous
-                prev = primitive.previous
-            else:
-                prev = primitive.previous
-                primitive.previous = tasks[primitive.previous.id]
-                if primitive.id not in [t.id for t in tasks[primitive.previous.id].next]:
-                    tasks[primitive.previous.id].next.append(primitive)
+        while primitive.previous is not None and id(primitive) not in visited:
+            visited.add(id(primitive))
+            prev = primitive.previous
+            kept = tasks.setdefault(prev.id, prev)
+            if kept is not prev:
+                primitive.previous = kept
+                ids = next_ids.get(kept.id)
+                if ids is None:
+                    ids = next_ids[kept.id] = {t.id for t in kept.next}
+                if primitive.id not in ids:
+                    ids.add(primitive.id)
+                    kept.next.append(primitive)
             primitive = prev
     return sols
 
 def select_conditional_plan(sols, controllable_agent_name, uncontrollable_agent_name, cost_dict={}):
-    all_branches = []
-    all_costs = []
-    def explore_policy(agents, action, cost):
-        new_agents = copy.deepcopy(agents) # check if needed
-
-        # Get the cost of the operator
-        cost_op = 0.0
-        if action.name != "BEGIN":
-            if action.name == "IDLE":
-                cost_op = idle_cost_function()
-            elif action.name == "WAIT":
-                cost_op = wait_cost_function()
-            else:
-                cost_op = action.cost
-        cost += cost_op
+    """
+    Selects the best policy of the robot in the plan graph of sols: each human action is followed by the robot action
+    of lowest cost, the cost of a robot action being the mean of the costs after the human actions that can follow it.
+    Returns a copy of the BEGIN action of the policy (see PolicySelection.copy), its cost, and for each branch of the
+    graph a copy of its actions (see _copy_branch) and its cost. The explored graph is not modified.
+    Listing the branches needs to go through every branch of the graph, see evaluate_policy to only select the policy.
+    """
+    begin_action = get_first_action(sols[0])
+    branches = []
+    selection = _PolicyEvaluation(controllable_agent_name, uncontrollable_agent_name, None, branches).run(begin_action)
+    return selection.copy(), selection.cost, [branch for branch, _ in branches], [cost for _, cost in branches]
 
-        # Check undesired states
-        undesired_state_penalty = 0.0
-        for undesired_state_check in undesired_state_functions:
-            undesired_state_penalty += undesired_state_check(new_agents)
-        cost += undesired_state_penalty
+def evaluate_policy(begin_action, controllable_agent_name, uncontrollable_agent_name, action_cost=None,
+                    criterion=None, cvar_level=0.1):
+    """
+    Selects the best policy of the robot in the plan graph explored from begin_action, as select_conditional_plan, and
+    returns it as a PolicySelection. The graph is neither copied nor modified, so the selection can be done again with
+    other costs. action_cost(action) gives the cost of an action, by default its cost, or the idle and wait costs.
+    Each action is evaluated once, even when it follows several actions because of the transpositions, except with
+    undesired sequence functions: as they depend on the whole branch, the actions are then evaluated for each branch.
+    With a criterion (a PolicyCriterion), the values of the actions are PolicyValues, computed in the same pass, and
+    the robot action selected after each human action is the one of lowest value for the criterion. cvar_level is the
+    fraction of the worst human actions averaged by the CVaR.
+    """
+    if criterion is not None and not 0.0 < cvar_level <= 1.0:
+        raise ValueError("The CVaR level must be in ]0, 1], got {}".format(cvar_level))
+    return _PolicyEvaluation(controllable_agent_name, uncontrollable_agent_name, action_cost, criterion=criterion,
+                             cvar_level=cvar_level).run(begin_action)
 
-        # Explore
-        # print("{}{}".format(action.name, action.parameters))
-        # print(" -> id={} cost={} state_penalty={} total={}".format(action.id, cost_op, undesired_state_penalty, cost))
+class PolicyCriterion(Enum):
+    """
+    Criterion selecting the robot actions in evaluate_policy, the value of a robot action followed by human actions
+    being its cost plus, over the values of the human actions:
+    - EXPECTED: their mean weighted by their probabilities, as select_conditional_plan
+    - WORST_CASE: the highest one
+    - BEST_CASE: the lowest one
+    - CVAR: the mean of the highest ones, of total probability cvar_level (the conditional value at risk)
+    The values of the other actions are their cost plus the value of the next action of the policy.
+    """
+    EXPECTED = 0
+    WORST_CASE = 1
+    BEST_CASE = 2
+    CVAR = 3
+
+# Values of an action for each PolicyCriterion, in the order of their values
+PolicyValues = namedtuple("PolicyValues", ["expected", "worst_case", "best_case", "cvar"])
+
+def _conditional_value_at_risk(values, weights, level):
+    """Mean of the highest values, of total weight level, the weights summing to 1."""
+    remaining = level
+    total = 0.0
+    for value, weight in sorted(zip(values, weights), key=lambda item: item[0], reverse=True):
+        taken = min(weight, remaining)
+        total += taken * value
+        remaining -= taken
+        if remaining <= 0.0:
+            break
+    # Less than level when the weights do not sum exactly to 1
+    return total / (level - remaining)
+
+def default_action_cost(action):
+    """Cost of an action in the policies: its cost, or the idle and wait costs, 0 for BEGIN."""
+    if action.name == "BEGIN":
+        return 0.0
+    if action.name == "IDLE":
+        return idle_cost_function()
+    if action.name == "WAIT":
+        return wait_cost_function()
+    return action.cost
+
+class PolicySelection:
+    """
+    Policy of the robot selected in a plan graph, as a view of the graph: choices maps the id of each human action
+    (and of BEGIN) with next actions to the robot action selected after it, the robot actions being followed by all
+    their next actions. values maps the id of each evaluated action to the cost of the best policy from it (or its
+    PolicyValues when selected with a criterion), cost being the one of begin_action.
+    """
+    def __init__(self, begin_action, cost, values, choices):
+        self.begin_action = begin_action
+        self.cost = cost
+        self.values = values
+        self.choices = choices
+
+    def next(self, action):
+        """The actions following action in the policy."""
+        choice = self.choices.get(id(action))
+        if choice is not None:
+            return [choice]
+        return list(action.next) if action.has_next() else []
+
+    def actions(self):
+        """Generates the actions of the policy, depth first from begin_action."""
+        stack = [self.begin_action]
+        while stack != []:
+            action = stack.pop()
+            yield action
+            stack.extend(reversed(self.next(action)))
+
+    def copy(self):
+        """
+        Copy of the actions of the policy, the copies being linked by their previous and next actions, as the result
+        of select_conditional_plan. Returns the copy of begin_action.
+        """
+        copies = {}
+        def copied(action, previous):
+            new = copies.get(id(action))
+            if new is None:
+                new = copies[id(action)] = copy.copy(action)
+                new.previous = previous
+                new.predecessor = copies.get(id(action.predecessor), action.predecessor)
+                new._next = _NO_NEXT
+            return new
+        first = copied(self.begin_action, self.begin_action.previous)
+        stack = [self.begin_action]
+        while stack != []:
+            action = stack.pop()
+            new = copies[id(action)]
+            successors = self.next(action)
+            if successors == []:
+                continue
+            new.next = [copied(successor, new) for successor in successors]
+            if id(action) in self.choices:
+                new.next[0].predecessor = new
+            stack.extend(successors)
+        return first
+
+class _PolicyEvaluation:
+    """
+    Evaluation of the actions of a plan graph, see evaluate_policy. If branches is a list, the copy and the cost of
+    every branch are added to it and the values are the costs from the root of the graph, as computed by
+    select_conditional_plan, instead of the costs from each action.
+    """
+    def __init__(self, controllable_agent_name, uncontrollable_agent_name, action_cost, branches=None, criterion=None,
+                 cvar_level=0.1):
+        self.controllable_agent_name = controllable_agent_name
+        self.uncontrollable_agent_name = uncontrollable_agent_name
+        self.action_cost = default_action_cost if action_cost is None else action_cost
+        self.branches = branches
+        self.criterion = criterion  # The values are PolicyValues if not None
+        self.cvar_level = cvar_level
+        self.memoize = branches is None and undesired_sequence_functions == []
+        self.values = {}
+        self.choices = {}
+        self.branch = []
+        self.state_penalty = _undesired_state_penalty()
+
+    def run(self, begin_action):
+        cost = _evaluate(self.evaluate(begin_action, 0))
+        return PolicySelection(begin_action, cost, self.values, self.choices)
+
+    def evaluate(self, action, cost):
+        """Generator returning the value of action, cost being the cost of the branch before it."""
+        if self.memoize and id(action) in self.values:
+            return self.values[id(action)]
+        self.branch.append(action)
+        action_cost = self.action_cost(action)
+        cost += action_cost
+        cost += self.state_penalty
+        value = cost if self.branches is not None else action_cost + self.state_penalty
+        if not action.has_next():
+            first_action = None
+            if self.branches is not None or undesired_sequence_functions != []:
+                first_action = _copy_branch(self.branch)
+            if undesired_sequence_functions != []:
+                undesired_sequence_penalty = _undesired_sequence_penalty(first_action)
+                cost += undesired_sequence_penalty
+                value += undesired_sequence_penalty
+            if self.branches is not None:
+                self.branches.append((first_action, cost))
+            if self.criterion is not None:
+                value = PolicyValues(value, value, value, value)
+        else:
+            base = 0.0 if self.branches is not None else value
+            if action.agent == self.controllable_agent_name:
+                # Mean over the human actions, weighted by their probabilities (see likelihood), the worst and
+                # best cases and the CVaR being computed as well with a criterion (see PolicyCriterion)
+                weights = _relative_weights([successor.probability for successor in action.next])
+                if self.criterion is None:
+                    total_cost = 0.0
+                    for successor, weight in zip(action.next, weights):
+                        total_cost += weight * (yield self.evaluate(successor, cost))
+                    value = base + total_cost / sum(weights)
+                else:
+                    successor_values = []
+                    for successor in action.next:
+                        successor_values.append((yield self.evaluate(successor, cost)))
+                    total_weight = sum(weights)
+                    expected = 0.0
+                    for successor_value, weight in zip(successor_values, weights):
+                        expected += weight * successor_value.expected
+                    value = PolicyValues(
+                        base + expected / total_weight,
+                        base + max(successor_value.worst_case for successor_value in successor_values),
+                        base + min(successor_value.best_case for successor_value in successor_values),
+                        base + _conditional_value_at_risk([successor_value.cvar for successor_value in successor_values],
+                                                          [weight / total_weight for weight in weights],
+                                                          self.cvar_level))
+            else:
+                # Best robot action after the human action
+                min_cost = None
+                for successor in action.next:
+                    successor_value = yield self.evaluate(successor, cost)
+                    if self.criterion is None:
+                        successor_cost = successor_value
+                    else:
+                        successor_cost = successor_value[self.criterion.value]
+                    if min_cost is None or successor_cost < min_cost:
+                        min_cost = successor_cost
+                        best_value = successor_value
+                        self.choices[id(action)] = successor
+                if self.criterion is None:
+                    value = base + best_value
+                else:
+                    value = PolicyValues(base + best_value.expected, base + best_value.worst_case,
+                                         base + best_value.best_case, base + best_value.cvar)
+        self.branch.pop()
+        self.values[id(action)] = value
+        return value
 
-        if action.next is None or action.next == []:
+def _undesired_state_penalty():
+    """
+    Penalty of the undesired states in the policies. The undesired states are checked on the initial agents, so their
+    penalty is the same for all the actions.
+    """
+    penalty = 0.0
+    for undesired_state_check in undesired_state_functions:
+        penalty += undesired_state_check(copy.deepcopy(agents))
+    return penalty
 
-            # Check undesired sequence
-            undesired_sequence_penalty = 0.0
+def _undesired_sequence_penalty(first_action):
+    """
+    Penalty of the undesired sequences of the branch starting with first_action, added to the cost of its leaf. Each
+    undesired sequence function adds the sum of its penalty and of the penalties of the functions before it.
+    """
+    total_penalty = 0.0
+    undesired_sequence_penalty = 0.0
+    for undesired_sequence_check in undesired_sequence_functions:
+        undesired_sequence_penalty += undesired_sequence_check(first_action)
+        total_penalty += undesired_sequence_penalty
+    return total_penalty
 
-            last_action = copy.deepcopy(action)
-            first_action = _backtrack_plan_one_branch(last_action, None) # set the action.next to only the specific action of this branch
+_LevelEdges = namedtuple("_LevelEdges", ["parents", "starts", "children", "weights"])
 
-            for undesired_sequence_check in undesired_sequence_functions:
-                undesired_sequence_penalty += undesired_sequence_check(first_action)
-                cost += undesired_sequence_penalty
+class PolicyGraph:
+    """
+    Plan graph explored from begin_action compiled into NumPy arrays, to select the policy of the robot for many
+    costs of the actions at once (see evaluate). The actions are numbered in actions, names and controllable giving
+    the name of each one and whether it is a robot action followed by human actions. For instance, the costs of the
+    actions with several idle costs are:
+        costs = np.tile(graph.costs(), (len(idle_costs), 1))
+        costs[:, graph.names == "IDLE"] = np.asarray(idle_costs)[:, None]
+    The edges to the next actions are grouped by the height of their action (the length of the longest branch from
+    it), the values of the actions of a height being computed at once from the ones of the lower heights.
+    The undesired state and sequence penalties are computed once when compiling. The sequence ones depend on the
+    branch leading to each leaf, so they need the graph to be a tree (without transpositions).
+    """
+    def __init__(self, begin_action, controllable_agent_name, uncontrollable_agent_name):
+        if np is None:
+            raise ImportError("PolicyGraph needs NumPy to be installed")
+        self.begin_action = begin_action
+        self.controllable_agent_name = controllable_agent_name
+        self.uncontrollable_agent_name = uncontrollable_agent_name
+        # Actions after their next actions (depth first post-order)
+        actions = []
+        index = {}  # id of action -> number
+        heights = []
+        parents = {}  # id of action -> number of its previous actions in the graph
+        visited = set()
+        stack = [(begin_action, False)]
+        while stack != []:
+            action, done = stack.pop()
+            successors = action.next if action.has_next() else []
+            if done:
+                index[id(action)] = len(actions)
+                actions.append(action)
+                heights.append(max((heights[index[id(successor)]] + 1 for successor in successors), default=0))
+                continue
+            if id(action) in visited:
+                continue
+            visited.add(id(action))
+            stack.append((action, True))
+            for successor in reversed(successors):
+                parents[id(successor)] = parents.get(id(successor), 0) + 1
+                if id(successor) not in visited:
+                    stack.append((successor, False))
+        self.actions = actions
+        self.root = index[id(begin_action)]
+        self.names = np.array([action.name for action in actions], dtype=object)
+        self.controllable = np.array([action.agent == controllable_agent_name and action.has_next()
+                                      for action in actions], dtype=bool)
+        self.penalties = np.full(len(actions), _undesired_state_penalty())
+        if undesired_sequence_functions != []:
+            if any(count > 1 for count in parents.values()):
+                raise ValueError("The undesired sequence penalties depend on the branch leading to each leaf, "
+                                 "they need the plan graph to be a tree, see evaluate_policy")
+            self._add_sequence_penalties(index)
+        by_height = {}
+        for number, height in enumerate(heights):
+            if height > 0:
+                by_height.setdefault(height, []).append(number)
+        self.levels = []  # (robot edges, human edges) of each height, increasing
+        for height in sorted(by_height):
+            numbers = by_height[height]
+            self.levels.append((self._edges([n for n in numbers if self.controllable[n]], index, True),
+                                self._edges([n for n in numbers if not self.controllable[n]], index, False)))
+
+    def _edges(self, parents, index, weighted):
+        """_LevelEdges from the actions numbered parents, the weights of the next actions of each one summing to 1."""
+        if parents == []:
+            return None
+        starts, children, weights = [], [], []
+        for parent in parents:
+            successors = self.actions[parent].next
+            starts.append(len(children))
+            children.extend(index[id(successor)] for successor in successors)
+            if weighted:
+                relative_weights = _relative_weights([successor.probability for successor in successors])
+                total_weight = sum(relative_weights)
+                weights.extend(weight / total_weight for weight in relative_weights)
+        return _LevelEdges(np.array(parents, dtype=np.intp), np.array(starts, dtype=np.intp),
+                           np.array(children, dtype=np.intp), np.array(weights, dtype=float))
+
+    def _add_sequence_penalties(self, index):
+        branch = []
+        stack = [(self.begin_action, 0)]
+        while stack != []:
+            action, depth = stack.pop()
+            del branch[depth:]
+            branch.append(action)
+            if action.has_next():
+                stack.extend((successor, depth + 1) for successor in reversed(action.next))
+            else:
+                self.penalties[index[id(action)]] += _undesired_sequence_penalty(_copy_branch(branch))
+
+    def costs(self, action_cost=None):
+        """Array of the costs of the actions given by action_cost(action), by default default_action_cost."""
+        action_cost = default_action_cost if action_cost is None else action_cost
+        return np.array([action_cost(action) for action in self.actions], dtype=float)
+
+    def evaluate(self, costs):
+        """
+        Values of the actions (the costs of the best policies from them) for each cost configuration, costs being an
+        array of the costs of the actions of shape (configurations, actions), or (actions,) for one configuration.
+        Returns an array of the same shape, the costs of the policies being values[..., graph.root].
+        """
+        costs = np.asarray(costs, dtype=float)
+        values = (np.atleast_2d(costs) + self.penalties).T.copy()  # (actions, configurations)
+        for robot_edges, human_edges in self.levels:
+            if robot_edges is not None:
+                # Mean over the human actions, weighted by their probabilities
+                weighted_values = values[robot_edges.children] * robot_edges.weights[:, None]
+                values[robot_edges.parents] += np.add.reduceat(weighted_values, robot_edges.starts, axis=0)
+            if human_edges is not None:
+                # Best robot action after the human action
+                values[human_edges.parents] += np.minimum.reduceat(values[human_edges.children], human_edges.starts,
+                                                                   axis=0)
+        return values.T if costs.ndim == 2 else values[:, 0]
+
+    def selection(self, values):
+        """PolicySelection of one cost configuration, values being its row of the result of evaluate."""
+        values = np.asarray(values)
+        choices = {}
+        for _, human_edges in self.levels:
+            if human_edges is None:
+                continue
+            ends = list(human_edges.starts[1:]) + [len(human_edges.children)]
+            for parent, start, end in zip(human_edges.parents, human_edges.starts, ends):
+                # argmin gives the first action of lowest cost, as evaluate_policy
+                best = human_edges.children[start + int(np.argmin(values[human_edges.children[start:end]]))]
+                choices[id(self.actions[parent])] = self.actions[best]
+        return PolicySelection(self.begin_action, float(values[self.root]),
+                               {id(action): float(value) for action, value in zip(self.actions, values)}, choices)
+
+def _copy_branch(actions):
+    """
+    Copies the given actions, chaining the copies with their previous and next attributes, and returns the first copy.
+    Contrary to backtracking from the last action, this gives the right branch when an action has several predecessors.
+    """
+    first = None
+    previous = None
+    for action in actions:
+        new = copy.copy(action)
+        new.previous = previous
+        new.next = None
+        if previous is None:
+            first = new
+        else:
+            previous.next = new
+        previous = new
+    return first
 
-            # print("============ branch ({}) seq_penalty={} total_cost={}\n".format(len(all_branches)+1, undesired_sequence_penalty, cost))
-            all_branches.append(first_action)
-            all_costs.append(cost)
-
-            return cost
-
-        if action.agent == controllable_agent_name:
-            total_cost = 0
-            # FUTURE WORK:
-            # Rather than just a mean, do a small optimization scheme
-            # that takes into account the average cost but also
-            # the worst and best cost possible
-            # For example if we have 3 possible human choices leading to
-            # 2 very good scenario (small costs) but 1 really really bad (huge cost)
-            # we can maybe bet on the rationnality of the human to not choose the worst action
-            # and bet on the 2 very good scenarios
-            for successor in action.next:
-                total_cost += explore_policy(new_agents, successor, cost)
-            return total_cost / len(action.next)
-
-        elif action.agent == uncontrollable_agent_name:
-            min_cost = explore_policy(new_agents, action.next[0], cost)
-            min_i_cost = 0
-            for i, successor in enumerate(action.next[1:]):
-                new_cost = explore_policy(new_agents, successor, cost)
-                if new_cost < min_cost:
-                    min_i_cost = i + 1
-                    min_cost = new_cost
-            action.next = [action.next[min_i_cost]]
-            action.next[0].predecessor = action
-            return min_cost
-
-    # Explore policies
-    begin_action = get_first_action(sols[0])
-    act = copy.deepcopy(begin_action)
-    cost = explore_policy(agents, act, 0)
+############################################################
+# Search of the best policy without exploring the whole tree
+_PolicyValue = namedtuple("_PolicyValue", "cost action")
+_PrunedValue = namedtuple("_PrunedValue", "lower_bound succeeds")  # The node fails or costs at least lower_bound
 
-    return act, cost, all_branches, all_costs
+class PolicySearch:
+    """
+    Finds the policy selected by select_conditional_plan without building the whole tree of seek_plan_robot: the
+    exploration and the selection are done together, depth first, taking the best robot action after each human action
+    and the mean over the possible human actions after each robot action. A robot action is not explored further once
+    its mean cost cannot be lower than the cost of an already explored alternative. This is only valid if the costs of
+    the operators and the penalties are not negative.
+    The costs are those of select_conditional_plan. human_prediction is the HumanPredictionType, beam the HumanBeam and symmetries
+    the classes of interchangeable objects of the search, as in SearchEngine.
+    """
+    def __init__(self, agents: Dict[str, Agent], agent_name, uncontrollable_agent_name="human", human_prediction=None,
+                 beam=None, symmetries=None):
+        self.agents = agents
+        self.agent_name = agent_name
+        self.uncontrollable_agent_name = uncontrollable_agent_name
+        self.human_prediction = human_prediction_type if human_prediction is None else human_prediction
+        self.beam = beam
+        self.symmetries = symmetry_classes if symmetries is None else symmetries
+        self.expanded_nodes = 0
+        self.pruned_alternatives = 0
+        self.pruned_human_actions = 0
+        self.max_pruned_probability = 0.0
+        self.pruned_symmetric_branches = 0
+        self.state_penalty = 0.0
+
+    def run(self):
+        """Returns the BEGIN action of the best policy and its cost, or (None, None) if the robot has no plan."""
+        begin_action = Operator("BEGIN", [], self.uncontrollable_agent_name, None, None, None)
+        self.state_penalty = _undesired_state_penalty()
+        result = _evaluate(self.choose_robot_action(self.agents, begin_action, self.action_cost(begin_action),
+                                                    float("inf")))
+        if result is None:
+            return None, None
+        return result.action, result.cost
+
+    def action_cost(self, action):
+        return default_action_cost(action) + self.state_penalty
+
+    def branch_cost(self, last_action, cost):
+        branch = []
+        while last_action is not None:
+            branch.append(last_action)
+            last_action = last_action.previous
+        return cost + _undesired_sequence_penalty(_copy_branch(reversed(branch)))
+
+    def choose_robot_action(self, agents, action, cost, bound):
+        """
+        Generator evaluating the best robot action after action (a human action or BEGIN), cost being the cost of the
+        branch up to action. Results lower than bound are exact, the other ones can be given as a _PrunedValue.
+        """
+        self.expanded_nodes += 1
+        best = None
+        pruned_success = pruned_unknown = can_stop = False
+        alternatives = _robot_alternatives(agents, self.agent_name)
+        if self.symmetries:
+            alternatives = _without_symmetric_alternatives(self, agents, alternatives)
+        for alternative in alternatives:
+            if alternative[self.agent_name].tasks == []:
+                can_stop = True
+                continue
+            limit = bound if best is None else min(best.cost, bound)
+            result = yield self.apply_robot_action(alternative, action, cost, limit)
+            if isinstance(result, _PrunedValue):
+                self.pruned_alternatives += 1
+                pruned_success = pruned_success or result.succeeds
+                pruned_unknown = pruned_unknown or not result.succeeds
+            elif result is not None and (best is None or result.cost < best.cost):
+                best = result
+        if best is not None:
+            action.next = [best.action]
+            best.action.predecessor = action
+            return _PolicyValue(best.cost, action)
+        if pruned_success or pruned_unknown:
+            return _PrunedValue(bound, pruned_success)
+        if can_stop:
+            action.next = []
+            return _PolicyValue(self.branch_cost(action, cost), action)
+        return None
+
+    def apply_robot_action(self, agents, previous_action, cost, bound):
+        """Generator evaluating the mean cost of the first task of the robot agenda, an operator, over the human actions."""
+        self.expanded_nodes += 1
+        newagents = _apply_operator(agents, self.agent_name, agents[self.agent_name].tasks[0], previous_action)
+        if newagents is False:
+            return None
+        action = newagents[self.agent_name].plan[-1]
+        cost += self.action_cost(action)
+        if cost >= bound:
+            return _PrunedValue(bound, False)
+        new_possible_agents = get_human_next_actions(newagents, self.uncontrollable_agent_name, previous_action=action,
+                                                     prediction_type=self.human_prediction)
+        if self.symmetries:
+            new_possible_agents = _merge_symmetric_human_actions(self, newagents, new_possible_agents)
+        new_possible_agents = _prune_human_actions(self, new_possible_agents)
+        # The mean is weighted by the probabilities of the human actions, as in select_conditional_plan
+        weights = _relative_weights([ag[self.uncontrollable_agent_name].plan[-1].probability
+                                     for ag in new_possible_agents])
+        total_cost = 0.0  # Weighted sum of the costs of the successors
+        total_weight = 0.0
+        successors = []
+        for i, ag in enumerate(new_possible_agents):
+            weight = weights[i]
+            remaining = sum(weights[i + 1:])
+            human_action = ag[self.uncontrollable_agent_name].plan[-1]
+            human_cost = cost + self.action_cost(human_action)
+            # Above this cost, the mean is at least bound whatever the other successors cost
+            successor_bound = (bound * (total_weight + weight + remaining) - total_cost - remaining * cost) / weight
+            result = yield self.choose_robot_action(ag, human_action, human_cost, successor_bound)
+            if isinstance(result, _PrunedValue):
+                if (_mean_lower_bound(total_cost, total_weight, remaining, cost) >= bound and
+                        _mean_lower_bound(total_cost + weight * successor_bound, total_weight + weight, remaining,
+                                          cost) >= bound):
+                    return _PrunedValue(bound, successors != [] or result.succeeds)
+                # The bound is not enough to conclude, e.g. because the human action may have no robot plan after it
+                result = yield self.choose_robot_action(ag, human_action, human_cost, float("inf"))
+            if result is not None:
+                total_cost += weight * result.cost
+                total_weight += weight
+                successors.append(result.action)
+            if successors != [] and _mean_lower_bound(total_cost, total_weight, remaining, cost) >= bound:
+                return _PrunedValue(bound, True)
+        if successors == []:
+            return None
+        action.next = successors
+        return _PolicyValue(total_cost / total_weight, action)
+
+def _mean_lower_bound(total_cost, weight, remaining, cost):
+    """
+    Lowest possible weighted mean of costs of total weight weight, whose weighted sum is total_cost, and of other costs
+    of total weight up to remaining, all of them at least cost. Infinite if there is no cost at all.
+    """
+    if weight + remaining == 0:
+        return float("inf")
+    return (total_cost + remaining * cost) / (weight + remaining)
+
+def _robot_alternatives(agents, agent_name):
+    """Yields the agents obtained by decomposing the agenda of agent_name until it is empty or starts with an operator."""
+    decompositions = [iter([agents])]
+    while decompositions != []:
+        agents = next(decompositions[-1], None)
+        if agents is None:
+            decompositions.pop()
+            continue
+        if agents[agent_name].tasks == [] or agents[agent_name].tasks[0].name in agents[agent_name].operators:
+            yield agents
+        elif agents[agent_name].tasks[0].name in agents[agent_name].methods:
+            decompositions.append(_decompose(agents, agent_name, agents[agent_name].tasks[0]))
+
+def _evaluate(generator):
+    """
+    Runs a generator yielding other generators and receiving their return values, as if they were recursive calls,
+    without being limited by the recursion limit.
+    """
+    generators = [generator]
+    value = None
+    while True:
+        try:
+            callee = generators[-1].send(value)
+        except StopIteration as stop:
+            generators.pop()
+            if generators == []:
+                return stop.value
+            value = stop.value
+            continue
+        generators.append(callee)
+        value = None
+
+def seek_policy_robot(agents: Dict[str, Agent], agent_name, uncontrollable_agent_name="human", human_prediction=None,
+                      beam=None):
+    """
+    Explores the plans of the robot and selects the best policy at the same time, see PolicySearch.
+    Returns the BEGIN action of the policy, as returned by select_conditional_plan, and its cost.
+    """
+    return PolicySearch(agents, agent_name, uncontrollable_agent_name, human_prediction, beam).run()
 
 def _backtrack_plan_one_branch(action, next):
-    if action is not None:
+    """
+    Sets the next action of action and of each of its previous actions to the single action following it in the
+    branch, next for action. Returns the first action of the branch, or next if action is None.
+    """
+    while action is not None:
         action.next = next
-        if action.previous is not None:
-            return _backtrack_plan_one_branch(action.previous, action)
-        else:
-            return _backtrack_plan_one_branch(None, action)
-    else:
-        return next
+        action, next = action.previous, action
+    return next
 
 def get_first_action(last_action):
         action = last_action
@@ -655,9 +2760,13 @@ def get_first_action(last_action):
             action = action.previous
 
 def get_last_actions(action):
-        if action.next is None or action.next == []:
-            return [action]
+        """The leaves of the tree of actions starting at action, from the first branch to the last one."""
         actions = []
-        for act in action.next:
-            actions += get_last_actions(act)
+        stack = [action]
+        while stack != []:
+            action = stack.pop()
+            if not action.has_next():
+                actions.append(action)
+            else:
+                stack.extend(reversed(action.next))
         return actions
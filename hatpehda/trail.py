@@ -0,0 +1,249 @@
+"""
+Undo trail for the in-place search (see InPlaceSearch in hatpehda.py).
+
+In this mode there is only one copy of the agents, modified by the operators and the decompositions and restored
+when the search backtracks. The dict, list and set values of the states are replaced by tracked subclasses, which
+save their content in the trail the first time they are modified after each mark, so they can be restored on undo.
+The other attributes of the states, the agendas and the plans are saved at each mark, which is cheap as the agendas
+and the plans are persistent containers.
+"""
+
+_current_trail = None  # Trail recording the modifications of the tracked containers, None outside of a search
+
+
+def track(value):
+    """value with its plain dicts, lists and sets (nested ones included) replaced by tracked copies."""
+    value_type = type(value)
+    if value_type is dict:
+        return TrackedDict({k: track(v) for k, v in value.items()})
+    if value_type is list:
+        return TrackedList([track(v) for v in value])
+    if value_type is set:
+        return TrackedSet(value)
+    return value
+
+
+class _Tracked:
+    """Saves the content of the container in the current trail before its first modification after each mark."""
+    __slots__ = ()
+
+    def _save(self):
+        trail = _current_trail
+        if trail is not None and self._level != trail.levels[-1]:
+            trail.entries.append((self, self._content()))
+            self._level = trail.levels[-1]
+
+
+class TrackedDict(_Tracked, dict):
+    __slots__ = ("_level",)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._level = None
+
+    def _content(self):
+        return dict(self)
+
+    def _restore(self, content):
+        dict.clear(self)
+        dict.update(self, content)
+
+    def __setitem__(self, key, value):
+        self._save()
+        dict.__setitem__(self, key, track(value))
+
+    def __delitem__(self, key):
+        self._save()
+        dict.__delitem__(self, key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self._save()
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, track(value))
+
+    def pop(self, *args):
+        self._save()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._save()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._save()
+        dict.clear(self)
+
+    def __reduce__(self):
+        return TrackedDict, (dict(self),)
+
+
+class TrackedList(_Tracked, list):
+    __slots__ = ("_level",)
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._level = None
+
+    def _content(self):
+        return list(self)
+
+    def _restore(self, content):
+        list.__setitem__(self, slice(None), content)
+
+    def __setitem__(self, index, value):
+        self._save()
+        if isinstance(index, slice):
+            value = [track(v) for v in value]
+        else:
+            value = track(value)
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        self._save()
+        list.__delitem__(self, index)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        self._save()
+        return list.__imul__(self, n)
+
+    def append(self, value):
+        self._save()
+        list.append(self, track(value))
+
+    def extend(self, values):
+        self._save()
+        list.extend(self, [track(v) for v in values])
+
+    def insert(self, index, value):
+        self._save()
+        list.insert(self, index, track(value))
+
+    def pop(self, *args):
+        self._save()
+        return list.pop(self, *args)
+
+    def remove(self, value):
+        self._save()
+        list.remove(self, value)
+
+    def clear(self):
+        self._save()
+        list.clear(self)
+
+    def sort(self, *args, **kwargs):
+        self._save()
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self._save()
+        list.reverse(self)
+
+    def __reduce__(self):
+        return TrackedList, (list(self),)
+
+
+class TrackedSet(_Tracked, set):
+    __slots__ = ("_level",)
+
+    def __init__(self, *args):
+        set.__init__(self, *args)
+        self._level = None
+
+    def _content(self):
+        return set(self)
+
+    def _restore(self, content):
+        set.clear(self)
+        set.update(self, content)
+
+    def _modifier(name):
+        method = getattr(set, name)
+        def modify(self, *args):
+            self._save()
+            return method(self, *args)
+        modify.__name__ = name
+        return modify
+
+    add = _modifier("add")
+    discard = _modifier("discard")
+    remove = _modifier("remove")
+    pop = _modifier("pop")
+    clear = _modifier("clear")
+    update = _modifier("update")
+    difference_update = _modifier("difference_update")
+    intersection_update = _modifier("intersection_update")
+    symmetric_difference_update = _modifier("symmetric_difference_update")
+    __ior__ = _modifier("__ior__")
+    __iand__ = _modifier("__iand__")
+    __isub__ = _modifier("__isub__")
+    __ixor__ = _modifier("__ixor__")
+    del _modifier
+
+    def __reduce__(self):
+        return TrackedSet, (set(self),)
+
+
+class Trail:
+    """
+    Modifications of the agents since each mark. undo() restores the agents as they were at the last mark.
+    The trail records the modifications of the tracked containers while it is active (see activate()).
+    """
+    def __init__(self, owner):
+        self.owner = owner  # Object whose agents attribute holds the agents being modified
+        self.entries = []  # (tracked container, content) saved since the first mark
+        self.levels = [0]  # Identifiers of the marks, the containers are saved once per mark
+        self.marks = []
+        self.next_level = 1
+
+    def activate(self):
+        global _current_trail
+        previous = _current_trail
+        _current_trail = self
+        return previous
+
+    @staticmethod
+    def deactivate(previous):
+        global _current_trail
+        _current_trail = previous
+
+    def mark(self):
+        agents = self.owner.agents
+        saved = []
+        for agent in agents.values():
+            state_dict = agent.state.__dict__
+            for name, value in state_dict.items():
+                # Containers set by the operators since the last mark
+                if type(value) in (dict, list, set):
+                    state_dict[name] = track(value)
+            saved.append((agent, agent.state, state_dict.copy(), agent.tasks.copy(), agent.plan.copy()))
+        self.marks.append((len(self.entries), agents, saved))
+        self.levels.append(self.next_level)
+        self.next_level += 1
+
+    def undo(self):
+        length, agents, saved = self.marks.pop()
+        self.levels.pop()
+        entries = self.entries
+        while len(entries) > length:
+            container, content = entries.pop()
+            container._restore(content)
+        for agent, state, state_dict, tasks, plan in saved:
+            agent.state = state
+            state.__dict__.clear()
+            state.__dict__.update(state_dict)
+            agent.tasks = tasks
+            agent.plan = plan
+        self.owner.agents = agents
@@ -0,0 +1,38 @@
+"""
+Branches of the explored plans (get_last_actions and _backtrack_plan_one_branch) on long plans.
+Run with pytest from the root of the package.
+"""
+
+import sys
+
+from hatpehda.hatpehda import Operator, _backtrack_plan_one_branch, get_last_actions
+
+LENGTH = 5000
+
+
+def action(name, previous=None):
+    new = Operator(name, [], "robot", None, 0, None)
+    if previous is not None:
+        new.previous = previous
+        previous.next.append(new)
+    return new
+
+
+def test_long_plan():
+    assert LENGTH > sys.getrecursionlimit()
+    first = action(0)
+    last = first
+    for i in range(1, LENGTH):
+        last = action(i, last)
+    other = action("other", first)
+    assert get_last_actions(first) == [last, other]
+    assert _backtrack_plan_one_branch(last, None) is first
+    assert first.next.name == 1
+    assert last.next is None
+
+
+def test_leaves_order():
+    first = action("first")
+    a, b = action("a", first), action("b", first)
+    leaves = [action("a0", a), action("a1", a), b]
+    assert get_last_actions(first) == leaves
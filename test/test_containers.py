@@ -0,0 +1,70 @@
+"""
+Agendas and plans of the agents (hatpehda.containers) compared with the lists they replace.
+Run with pytest from the root of the package.
+"""
+
+import pickle
+
+import pytest
+
+from hatpehda.containers import Agenda, PlanHistory
+
+
+def test_agenda_as_list():
+    tasks = ["t0", "t1", "t2", "t3"]
+    agenda = Agenda(tasks)
+    assert agenda == tasks and len(agenda) == 4
+    assert agenda[0] == "t0" and agenda[-1] == "t3"
+    assert agenda[1:] == tasks[1:] and agenda[1:3] == tasks[1:3] and agenda[::2] == tasks[::2]
+    assert ["a", "b"] + agenda[1:] == ["a", "b"] + tasks[1:]
+    assert agenda + ["a"] == tasks + ["a"]
+    assert list(reversed(agenda)) == tasks[::-1]
+    with pytest.raises(IndexError):
+        agenda[4]
+
+    operations = [
+        lambda l: l.__setitem__(1, "x"),
+        lambda l: l.__delitem__(0),
+        lambda l: l.insert(-1, "y"),
+        lambda l: l.insert(10, "z"),
+        lambda l: l.extend(["u", "v"]),
+        lambda l: l.__setitem__(slice(1, 3), ["s"]),
+        lambda l: l.__delitem__(slice(None, None, 2)),
+        lambda l: l.append("w"),
+        lambda l: l.pop(0),
+        lambda l: l.remove("w"),
+    ]
+    expected = list(tasks)
+    for operation in operations:
+        operation(agenda)
+        operation(expected)
+        assert agenda == expected and len(agenda) == len(expected)
+    agenda.clear()
+    assert agenda == [] and len(agenda) == 0
+
+
+def test_agenda_copies_independent():
+    agenda = Agenda(["t0", "t1", "t2"])
+    copy = agenda.copy()
+    rest = agenda[1:]
+    agenda[2] = "x"
+    copy.insert(0, "y")
+    rest += ["z"]
+    assert agenda == ["t0", "t1", "x"]
+    assert copy == ["y", "t0", "t1", "t2"]
+    assert rest == ["t1", "t2", "z"]
+    assert pickle.loads(pickle.dumps(copy)) == copy
+
+
+def test_plan_history_as_list():
+    actions = ["a0", "a1", "a2"]
+    plan = PlanHistory(actions)
+    assert plan == actions and len(plan) == 3
+    assert plan[0] == "a0" and plan[-1] == "a2" and plan[1:] == actions[1:]
+    assert list(reversed(plan)) == actions[::-1]
+    with pytest.raises(IndexError):
+        plan[-4]
+    copy = plan.copy()
+    plan.append("a3")
+    assert plan == actions + ["a3"] and copy == actions
+    assert pickle.loads(pickle.dumps(plan)) == plan
@@ -0,0 +1,78 @@
+"""
+Facts of the states (hatpehda.facts).
+Run with pytest from the root of the package.
+"""
+
+import pytest
+
+import hatpehda
+from hatpehda.facts import FactIndex, add_fact, delete_fact, holds
+
+
+def make_state():
+    state = hatpehda.State("init")
+    state.isHolding = {"human": []}
+    state.isAt = {"robot": "table"}
+    return state
+
+
+def test_add_facts_to_missing_subject():
+    state = make_state()
+    add_fact(state, ("isHolding", "robot", "c1"))
+    add_fact(state, ("isHolding", "robot", "c2"))
+    assert state.isHolding["robot"] == ["c1", "c2"]
+    assert holds(state, ("isHolding", "robot", "c1")) and holds(state, ("isHolding", "robot", "c2"))
+
+
+def test_replace_value_not_collection():
+    state = make_state()
+    with pytest.raises(ValueError):
+        add_fact(state, ("isAt", "robot", "shelf"))
+    assert state.isAt["robot"] == "table"
+    add_fact(state, ("isAt", "robot", "table"))
+    delete_fact(state, ("isAt", "robot", "table"))
+    add_fact(state, ("isAt", "robot", "shelf"))
+    assert state.isAt["robot"] == "shelf"
+
+
+@pytest.fixture(params=["int", "numpy"])
+def index(request):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    return FactIndex(request.param)
+
+
+def make_fact_state():
+    state = hatpehda.State("init")
+    state.isHolding = {"human": ["c1", "c2"], "robot": []}
+    state.isOn = {"c1": "table", "c2": None}
+    state.seen = {"c1"}
+    state.door = "open"
+    return state
+
+
+def test_fact_set_round_trip(index):
+    state = make_fact_state()
+    facts = index.from_state(state)
+    assert set(facts) == {("isHolding", "human", "c1"), ("isHolding", "human", "c2"), ("isOn", "c1", "table"),
+                          ("isOn", "c2", None), ("seen", None, "c1"), ("door", None, "open")}
+    copy = index.to_state(facts, hatpehda.State("copy"))
+    for name in ("isHolding", "isOn", "seen", "door"):
+        assert getattr(copy, name) == getattr(state, name)
+    assert index.from_state(copy) == facts and hash(index.from_state(copy)) == hash(facts)
+
+
+def test_fact_set_operations(index):
+    facts = index.from_state(make_fact_state())
+    add = index.encode([("isHolding", "robot", "c3"), ("door", None, "closed")])
+    delete = index.encode([("door", None, "open"), ("isHolding", "human", "c1")])
+    result = facts.apply(add=add, delete=delete)
+    assert set(result) == (set(facts) - set(delete)) | set(add)
+    assert ("isHolding", "robot", "c3") in result and ("door", None, "open") not in result
+    assert delete <= facts and not add <= facts and result >= add
+    assert len(facts | add) == len(facts) + len(add) and not (facts & add)
+    # The sets created before interning new facts are compared with the newer ones
+    assert facts == index.from_state(make_fact_state()) and facts != result
+    assert index.applicable([facts, result], delete) == [True, False]
+    state = index.to_state(result, hatpehda.State("result"))
+    assert state.isHolding == {"human": ["c2"], "robot": ["c3"]} and state.door == "closed"
@@ -0,0 +1,95 @@
+"""
+Parallel search (seek_plan_robot with workers) compared with the search done by a single process.
+Run with pytest from the root of the package.
+"""
+
+import copy
+
+import hatpehda
+
+CUBES = ["c0", "c1"]
+
+
+def pick(agents, self_state, self_name, cube):
+    if cube not in self_state.on_table or self_state.holding[self_name] is not None:
+        return False
+    for agent in agents.values():
+        agent.state.on_table.remove(cube)
+        agent.state.holding[self_name] = cube
+    return agents, 1.0
+
+
+def drop(agents, self_state, self_name, cube):
+    if self_state.holding[self_name] != cube:
+        return False
+    for agent in agents.values():
+        agent.state.holding[self_name] = None
+        agent.state.in_box.append(cube)
+    return agents, 1.0
+
+
+@hatpehda.multi_decomposition
+def tidy(agents, self_state, self_name, count):
+    if count == 0:
+        return [[]]
+    return [[("pick", c), ("drop", c), ("tidy", count - 1)] for c in CUBES if c in self_state.on_table]
+
+
+def setup():
+    hatpehda.reset_planner()
+    state = hatpehda.State("init")
+    state.on_table = list(CUBES)
+    state.in_box = []
+    state.holding = {"robot": None, "human": None}
+    for name in ("robot", "human"):
+        hatpehda.declare_operators(name, pick, drop)
+        hatpehda.declare_methods(name, "tidy", tidy)
+        hatpehda.set_state(name, copy.deepcopy(state))
+        hatpehda.add_tasks(name, [("tidy", 1)])
+
+
+def plan(**kwargs):
+    setup()
+    sols = []
+    hatpehda.seek_plan_robot(hatpehda.hatpehda.agents, "robot", sols, "human", **kwargs)
+    best, cost = hatpehda.select_conditional_plan(sols, "robot", "human")[:2]
+    return cost, tree(best)
+
+
+def tree(action):
+    return action.name, tuple(action.parameters), tuple(tree(successor) for successor in action.next)
+
+
+def test_same_policy_as_single_process():
+    expected = plan()
+    for parallel_depth in range(1, 6):
+        assert plan(workers=2, parallel_depth=parallel_depth) == expected
+
+
+def test_robot_agenda_empty_at_parallel_depth():
+    # The robot tasks left after the first robot and human actions decompose to nothing: the workers return the
+    # copy of the human action they started from, which has to be replaced by the action itself
+    expected = plan()
+    assert plan(workers=2, parallel_depth=3) == expected
+    assert plan(workers=2, parallel_depth=3, transpositions=True) == expected
+
+
+def test_budget_of_whole_search():
+    setup()
+    budget = hatpehda.SearchBudget(max_nodes=6)
+    result = hatpehda.seek_plan_robot(hatpehda.hatpehda.agents, "robot", [], "human", workers=2, parallel_depth=2,
+                                      budget=budget)
+    assert not result.complete and result.stop_reason == "nodes"
+    assert result.expanded_nodes <= 2 * budget.max_nodes
+
+
+def test_max_depth_from_root():
+    # The depth of the nodes of the subtrees is counted from the root of the whole search
+    for max_depth in range(1, 6):
+        results = []
+        for kwargs in ({}, {"workers": 2, "parallel_depth": 2}):
+            setup()
+            result = hatpehda.seek_plan_robot(hatpehda.hatpehda.agents, "robot", [], "human",
+                                              budget=hatpehda.SearchBudget(max_depth=max_depth), **kwargs)
+            results.append((result.complete, result.solutions, result.max_depth))
+        assert results[0] == results[1]
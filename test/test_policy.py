@@ -0,0 +1,150 @@
+"""
+Selection of the policy of the robot: select_conditional_plan, seek_policy_robot and evaluate_policy.
+Run with pytest from the root of the package.
+"""
+
+import copy
+
+import pytest
+
+import hatpehda
+
+CUBES = ["c0", "c1", "c2"]
+WEIGHTS = {"c0": 1.0, "c1": 3.0, "c2": 5.0}
+
+
+def pick(agents, self_state, self_name, cube):
+    if cube not in self_state.on_table or self_state.holding[self_name] is not None:
+        return False
+    for agent in agents.values():
+        agent.state.on_table.remove(cube)
+        agent.state.holding[self_name] = cube
+    return agents, WEIGHTS[cube] if self_name == "robot" else 1.0
+
+
+def drop(agents, self_state, self_name, cube):
+    if self_state.holding[self_name] != cube:
+        return False
+    for agent in agents.values():
+        agent.state.holding[self_name] = None
+        agent.state.in_box.append(cube)
+    return agents, 1.0
+
+
+@hatpehda.multi_decomposition
+def tidy(agents, self_state, self_name):
+    return [[("pick", c), ("drop", c), ("tidy",)] for c in CUBES if c in self_state.on_table]
+
+
+def cubes_on_table(agents):
+    return 0.5 * len(agents["robot"].state.on_table)
+
+
+@pytest.fixture
+def penalties():
+    yield hatpehda.set_undesired_state_functions
+    hatpehda.set_undesired_state_functions([])
+    hatpehda.set_undesired_sequence_functions([])
+
+
+def setup():
+    hatpehda.reset_planner()
+    state = hatpehda.State("init")
+    state.on_table = list(CUBES)
+    state.in_box = []
+    state.holding = {"robot": None, "human": None}
+    for name in ("robot", "human"):
+        hatpehda.declare_operators(name, pick, drop)
+        hatpehda.declare_methods(name, "tidy", tidy)
+        hatpehda.set_state(name, copy.deepcopy(state))
+        hatpehda.add_tasks(name, [("tidy",)])
+
+
+def explore():
+    setup()
+    sols = []
+    hatpehda.seek_plan_robot(hatpehda.hatpehda.agents, "robot", sols, "human")
+    return sols
+
+
+def tree(action):
+    return action.name, tuple(action.parameters), tuple(tree(successor) for successor in action.next)
+
+
+def test_policy_search_same_state_penalty(penalties):
+    penalties([cubes_on_table])
+    best, cost = hatpehda.select_conditional_plan(explore(), "robot", "human")[:2]
+    setup()
+    policy, policy_cost = hatpehda.seek_policy_robot(hatpehda.hatpehda.agents, "robot", "human")
+    assert policy_cost == pytest.approx(cost)
+    assert tree(policy) == tree(best)
+
+
+def test_policy_graph_same_values(penalties):
+    np = pytest.importorskip("numpy")
+    penalties([cubes_on_table])
+    begin_action = hatpehda.get_first_action(explore()[0])
+    graph = hatpehda.PolicyGraph(begin_action, "robot", "human")
+
+    def heavy_drops(action):
+        return hatpehda.default_action_cost(action) + (2.0 if action.name == "drop" else 0.0)
+
+    all_values = graph.evaluate(np.stack([graph.costs(), graph.costs(heavy_drops)]))
+    for action_cost, values in zip([None, heavy_drops], all_values):
+        expected = hatpehda.evaluate_policy(begin_action, "robot", "human", action_cost)
+        selection = graph.selection(values)
+        assert selection.cost == pytest.approx(expected.cost)
+        for action in graph.actions:
+            assert selection.values[id(action)] == pytest.approx(expected.values[id(action)])
+        assert tree(selection.copy()) == tree(expected.copy())
+
+
+def action(name, agent, cost, previous=None, probability=1.0):
+    new = hatpehda.hatpehda.Operator(name, [], agent, None, 0, None)
+    new.cost = cost
+    new.probability = probability
+    if previous is not None:
+        new.previous = previous
+        previous.next.append(new)
+    return new
+
+
+def criterion_graph():
+    """
+    After BEGIN, the robot action risky is followed by human actions of costs 1, 5 and 10 and of probabilities 0.5, 0.3
+    and 0.2, the robot action safe by a single human action of cost 4.
+    """
+    begin_action = action("BEGIN", "human", 0.0)
+    risky = action("risky", "robot", 1.0, begin_action)
+    safe = action("safe", "robot", 2.0, begin_action)
+    for cost, probability in [(1.0, 0.5), (5.0, 0.3), (10.0, 0.2)]:
+        action("human_action", "human", cost, risky, probability)
+    action("human_action", "human", 4.0, safe)
+    return begin_action, risky, safe
+
+
+@pytest.mark.parametrize("criterion, cvar_level, risky_value, best", [
+    (hatpehda.PolicyCriterion.EXPECTED, 0.1, 5.0, "risky"),
+    (hatpehda.PolicyCriterion.WORST_CASE, 0.1, 11.0, "safe"),
+    (hatpehda.PolicyCriterion.BEST_CASE, 0.1, 2.0, "risky"),
+    (hatpehda.PolicyCriterion.CVAR, 0.1, 11.0, "safe"),
+    (hatpehda.PolicyCriterion.CVAR, 0.5, 1.0 + (0.2 * 10.0 + 0.3 * 5.0) / 0.5, "safe"),
+    (hatpehda.PolicyCriterion.CVAR, 1.0, 5.0, "risky"),
+])
+def test_policy_criterion_values(criterion, cvar_level, risky_value, best):
+    begin_action, risky, safe = criterion_graph()
+    selection = hatpehda.evaluate_policy(begin_action, "robot", "human", criterion=criterion, cvar_level=cvar_level)
+    assert selection.values[id(risky)][criterion.value] == pytest.approx(risky_value)
+    assert tuple(selection.values[id(safe)]) == pytest.approx((6.0, 6.0, 6.0, 6.0))
+    assert selection.choices[id(begin_action)].name == best
+    assert selection.cost[criterion.value] == pytest.approx(min(risky_value, 6.0))
+    # The expected values do not depend on the criterion
+    assert selection.values[id(risky)].expected == pytest.approx(5.0)
+
+
+def test_policy_criterion_cvar_level():
+    begin_action = criterion_graph()[0]
+    for cvar_level in (0.0, 1.5):
+        with pytest.raises(ValueError):
+            hatpehda.evaluate_policy(begin_action, "robot", "human", criterion=hatpehda.PolicyCriterion.CVAR,
+                                     cvar_level=cvar_level)
@@ -0,0 +1,73 @@
+"""
+Options of the search (seek_plan_robot) compared with the default search.
+Run with pytest from the root of the package.
+"""
+
+import copy
+
+import pytest
+
+import hatpehda
+
+
+def set_x(agents, self_state, self_name, x):
+    for agent in agents.values():
+        agent.state.x = x
+    return agents, 1.0
+
+
+def finish(agents, self_state, self_name):
+    if self_state.x != -1:
+        return False
+    return agents, 1.0
+
+
+@hatpehda.multi_decomposition
+def work(agents, self_state, self_name):
+    # hash(-1) == hash(-2), so both states have the same fingerprint
+    return [[("set_x", -2), ("finish",)], [("set_x", -1), ("finish",)]]
+
+
+def setup():
+    hatpehda.reset_planner()
+    state = hatpehda.State("init")
+    state.x = 0
+    hatpehda.declare_operators("robot", set_x, finish)
+    hatpehda.declare_methods("robot", "work", work)
+    hatpehda.set_state("robot", copy.deepcopy(state))
+    hatpehda.add_tasks("robot", [("work",)])
+    hatpehda.declare_operators("human")
+    hatpehda.set_state("human", copy.deepcopy(state))
+
+
+def branches(**kwargs):
+    setup()
+    sols = []
+    hatpehda.seek_plan_robot(hatpehda.hatpehda.agents, "robot", sols, "human", **kwargs)
+    result = []
+    for action in sols:
+        branch = []
+        while action is not None:
+            branch.append((action.name, tuple(action.parameters)))
+            action = action.previous
+        result.append(branch[::-1])
+    return result
+
+
+def test_transpositions_compare_states_exactly():
+    expected = branches()
+    assert expected == [[("BEGIN", ()), ("set_x", (-1,)), ("IDLE", ()), ("finish", ()), ("IDLE", ())]]
+    assert branches(transpositions=True) == expected
+
+
+def test_memory_budget_uses_current_memory():
+    memory = hatpehda.hatpehda.current_memory()
+    if memory is None:
+        pytest.skip("The resident memory of the process cannot be read")
+    # Raises the peak resident memory of the process well above the limit, but not its current resident memory
+    allocated = b"x" * (200 * 1024 * 1024)
+    del allocated
+    setup()
+    result = hatpehda.seek_plan_robot(hatpehda.hatpehda.agents, "robot", [], "human",
+                                      budget=hatpehda.SearchBudget(max_memory=memory + 100))
+    assert result.success and result.complete
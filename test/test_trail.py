@@ -0,0 +1,91 @@
+"""
+Undo trail of the in-place search (hatpehda.trail): the tracked containers of the states restored by undo.
+Run with pytest from the root of the package.
+"""
+
+import copy
+import types
+
+import pytest
+
+import hatpehda
+from hatpehda.hatpehda import Agent
+from hatpehda.trail import Trail, TrackedDict, TrackedList, TrackedSet
+
+
+def make_agents():
+    agent = Agent("robot")
+    agent.state = hatpehda.State("init")
+    agent.state.holding = {"robot": None, "human": ["c0"]}
+    agent.state.on_table = ["c1", "c2"]
+    agent.state.seen = {"c0"}
+    agent.state.x = 0
+    agent.tasks = [("tidy",)]
+    return {"robot": agent}
+
+
+def content(agents):
+    state = agents["robot"].state
+    return (copy.deepcopy(state.holding), list(state.on_table), set(state.seen), state.x,
+            list(agents["robot"].tasks), list(agents["robot"].plan))
+
+
+@pytest.fixture
+def trail():
+    owner = types.SimpleNamespace(agents=make_agents())
+    trail = Trail(owner)
+    previous = trail.activate()
+    yield trail
+    Trail.deactivate(previous)
+
+
+def modify(agents, step):
+    agent = agents["robot"]
+    state = agent.state
+    state.holding["robot"] = "c{}".format(step)
+    state.holding["human"].append("h{}".format(step))
+    state.holding.setdefault("other", []).append(step)
+    state.on_table.remove(state.on_table[0])
+    state.on_table.insert(0, "t{}".format(step))
+    state.on_table.sort()
+    state.seen.add(step)
+    state.seen -= {"c0"}
+    state.x += 1
+    agent.tasks = agent.tasks[1:] + [("step", step)]
+    agent.plan.append(step)
+
+
+def test_containers_tracked_at_mark(trail):
+    trail.mark()
+    state = trail.owner.agents["robot"].state
+    assert type(state.holding) is TrackedDict and type(state.holding["human"]) is TrackedList
+    assert type(state.on_table) is TrackedList and type(state.seen) is TrackedSet
+    state.holding["robot"] = {"nested": []}
+    assert type(state.holding["robot"]) is TrackedDict and type(state.holding["robot"]["nested"]) is TrackedList
+
+
+def test_undo_each_mark(trail):
+    contents = []
+    for step in range(3):
+        contents.append(content(trail.owner.agents))
+        trail.mark()
+        # Modified twice after the mark, only the content at the mark is restored
+        modify(trail.owner.agents, step)
+        modify(trail.owner.agents, step + 10)
+    for expected in reversed(contents):
+        trail.undo()
+        assert content(trail.owner.agents) == expected
+    assert trail.entries == [] and trail.marks == []
+
+
+def test_not_recorded_without_active_trail(trail):
+    trail.mark()
+    state = trail.owner.agents["robot"].state
+    Trail.deactivate(None)
+    state.on_table.append("c3")
+    state.seen.discard("c0")
+    state.holding.pop("human")
+    assert trail.entries == []
+    trail.activate()
+    trail.undo()
+    assert state.on_table == ["c1", "c2", "c3"] and state.seen == set() and "human" not in state.holding